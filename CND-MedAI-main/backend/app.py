@@ -1,346 +1,600 @@
-from flask import Flask, request, jsonify
+import time
+# Startup time is measured from here and reported by the health route
+APP_STARTED = time.perf_counter()
+from flask import Flask, Request, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from PIL import Image
 import torch
-import torch.nn as nn
-import torch.nn.functional as F
-import pandas as pd
-from torchvision import transforms, models
-import timm
+import csv
 import os
+import importlib
+import io
+import json
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from werkzeug.utils import secure_filename
 import random
+from model_loading import (weight_store, subtype_to_model, load_served_model, INFERENCE_BACKEND, QUANTIZED_MODELS,
+                           CPU_PROFILE_MODELS, CPU_PROFILE_COMPILE, cpu_profile_reports)
+from model_registry import ModelRegistry
+from job_queue import JobQueue
+from model_shards import ModelShards, parse_shards
+from background_loader import BackgroundLoader
+from metrics import MetricsRegistry, StageTimer, server_timing_header, resident_memory_bytes, peak_resident_memory_bytes
+from preprocessing import (PreparedImage, batch_tensor, decode_image, final_variant, IMAGE_EXTENSIONS,
+                           NORMAL, SUBTYPE, CENTER_CROP, SQUARE)
+from batching import MicroBatcher
+from cascade import CascadeStats, group_confidences, subtype_group, NOT_OUR_MODALITY, CONFIDENT_SUBTYPE, FULL
+from result_cache import ResultCache, model_fingerprint, content_digest
+import eeg
 
 app = Flask(__name__)
-CORS(app)
-UPLOAD_FOLDER = "temp_uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+CORS(app, expose_headers=["Server-Timing"])
+
+UPLOAD_SPOOL_MAX_BYTES = int(os.environ.get("UPLOAD_SPOOL_MAX_BYTES", 32 * 1024 * 1024))
+
+class UploadRequest(Request):
+    """
+    Uploads are kept in memory and read straight from the request instead of being saved to disk.
+    Files larger than UPLOAD_SPOOL_MAX_BYTES (e.g. very large CSVs) spill to an anonymous,
+    uniquely named temporary file that is removed as soon as the request is done.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode="rb+")
+
+app.request_class = UploadRequest
+
+# ---- Metrics ----
+# GET /metrics serves Prometheus metrics for this process (under gunicorn each worker reports its own).
+# SERVER_TIMING=1, or ?timing=1 on a single request, adds a Server-Timing header with the
+# per-stage breakdown (upload, decode, preprocess, forward per model) of the request.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+metrics = MetricsRegistry("cnd")
+request_count = metrics.counter("requests_total", "HTTP requests by route, method and status code",
+                                ["route", "method", "status"])
+request_latency = metrics.histogram("request_duration_seconds",
+                                    "Request handling time by route, including streamed response bodies", ["route"])
+stage = StageTimer(metrics.histogram("stage_duration_seconds",
+                                     "Time spent in each stage of request handling (model is set for forward passes)",
+                                     ["stage", "model"]))
+requests_in_flight = metrics.gauge("requests_in_flight", "Requests currently being handled")
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    requests_in_flight.inc()
+    if request.method == "POST":
+        with stage("upload"):
+            request.files  # parses the multipart body
+
+@app.after_request
+def add_server_timing(response):
+    g.status = response.status_code
+    if "request_started" in g and (SERVER_TIMING or request.args.get("timing") == "1"):
+        response.headers["Server-Timing"] = server_timing_header(
+            g.get("stage_timings", {}), time.perf_counter() - g.request_started)
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    # Runs once the response (including a streamed body) has been sent
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    requests_in_flight.dec()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_latency.observe(time.perf_counter() - started, route)
+    request_count.inc(route, request.method, g.get("status", 500))
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# ---- Model definitions ----
-class SimpleCNN(nn.Module):
-    def __init__(self):
-        super().__init__()
-        self.conv1 = nn.Conv2d(3, 32, 3, padding=1)
-        self.pool = nn.MaxPool2d(2, 2)
-        self.conv2 = nn.Conv2d(32, 64, 3, padding=1)
-        self.fc1 = nn.Linear(64 * 56 * 56, 128)
-        self.fc2 = nn.Linear(128, 1)
-    def forward(self, x):
-        x = self.pool(F.relu(self.conv1(x)))
-        x = self.pool(F.relu(self.conv2(x)))
-        x = x.view(-1, 64 * 56 * 56)
-        x = F.relu(self.fc1(x))
-        x = torch.sigmoid(self.fc2(x))
-        return x
-
-def load_second_model(device):
-    model2 = models.resnet18(weights=None)
-    model2.fc = nn.Sequential(
-        nn.Dropout(0.5),
-        nn.Linear(model2.fc.in_features, 1),
-        nn.Sigmoid()
-    )
-    model2.load_state_dict(torch.load("./AI-Models/2nd_Pipeline.pth", map_location=device))
-    model2.to(device)
-    model2.eval()
-    return model2
-
-def load_third_model(device):
-    model3 = timm.create_model('efficientnet_b0', pretrained=False, num_classes=5)
-    model3.load_state_dict(torch.load("./AI-Models/3rd_Pipeline.pth", map_location=device))
-    model3.to(device)
-    model3.eval()
-    return model3
-
-model_stage1 = SimpleCNN().to(device)
-model_stage1.load_state_dict(torch.load("./AI-Models/1st_Pipeline.pth", map_location=device))
-model_stage1.eval()
-model_stage2 = load_second_model(device)
-model_stage3 = load_third_model(device)
+# ---- Model loading (checkpoint loaders and the serving backend are in model_loading.py) ----
+if weight_store.manifest is not None:
+    print(f"Using weight store {weight_store.path} ({len(weight_store.manifest['models'])} checkpoints)")
+
+def import_model_libraries():
+    # Imported once up front - several loader threads importing the same packages at once can deadlock.
+    # Only the import matters (the loaders use them), hence import_module rather than unused names.
+    for module in ("torchvision", "timm"):
+        importlib.import_module(module)
+
+# BACKGROUND_MODEL_LOADING=1 starts serving straight away and loads the models on MODEL_LOAD_WORKERS
+# background threads. Requests that need a model wait for it; the health route reports readiness.
+BACKGROUND_MODEL_LOADING = os.environ.get("BACKGROUND_MODEL_LOADING", "0") == "1"
+MODEL_LOAD_WORKERS = int(os.environ.get("MODEL_LOAD_WORKERS", 4))
+model_loader = BackgroundLoader(background=BACKGROUND_MODEL_LOADING, workers=MODEL_LOAD_WORKERS,
+                                prepare=import_model_libraries, started=APP_STARTED)
+
+model_stage1 = model_loader.submit("stage1", lambda: load_served_model("stage1", device))
+model_stage2 = model_loader.submit("stage2", lambda: load_served_model("stage2", device))
+model_stage3 = model_loader.submit("stage3", lambda: load_served_model("stage3", device))
 
 class_names_stage2 = ['Cancer', 'Neurological Disorder']
 class_names_stage3 = ["cancer_breast", "cancer_colon", "cancer_lung", "neuro_alzheimers", "neuro_ms"]
 
-# Map subtype to final diagnostic model file
-subtype_to_model = {
-    "cancer_breast": "./AI-Models/Breast.pth",
-    "cancer_colon": "./AI-Models/Colon.pth",
-    "cancer_lung": "./AI-Models/Lung.pth",
-    "neuro_alzheimers": "./AI-Models/Alzheimer.pth",
-    "neuro_ms": "./AI-Models/MultipleSclerosis.pth",
-}
+# Keep the disease-specific models resident instead of reloading the .pth on every /diagnose call.
+# FINAL_MODEL_CACHE_SIZE bounds how many stay in memory (least recently used is evicted first).
+FINAL_MODEL_CACHE_SIZE = int(os.environ.get("FINAL_MODEL_CACHE_SIZE", len(subtype_to_model)))
+final_models = ModelRegistry(lambda subtype: load_served_model(subtype, device),
+                             max_size=FINAL_MODEL_CACHE_SIZE, name="final_models")
 
-def load_final_model(subtype, device):
-    from torchvision import models
-    """Load the disease-specific final diagnostic model"""
-    model_path = subtype_to_model.get(subtype)
-    if not model_path or not os.path.exists(model_path):
-        print(f"Model path not found: {model_path}")
-        return None
-    
-    try:
-        checkpoint = torch.load(model_path, map_location=device)
-        
-        # Print checkpoint structure for debugging
-        print(f"Loading {subtype} from {model_path}")
-        if isinstance(checkpoint, dict):
-            print(f"Checkpoint keys: {list(checkpoint.keys())[:10]}")
-            # Check if it's wrapped in a 'model' or 'state_dict' key
-            if 'state_dict' in checkpoint:
-                checkpoint = checkpoint['state_dict']
-            elif 'model' in checkpoint:
-                checkpoint = checkpoint['model']
-        
-        # Load based on known architecture for each disease
-        if subtype == "neuro_alzheimers":
-            # EfficientNet-B3 with 4 classes (matches notebook training)
-            # Classes: Mild Impairment, Moderate Impairment, No Impairment, Very Mild Impairment
-            # Will be mapped to binary: No Impairment -> No Alzheimer, others -> Alzheimer
-            try:
-                model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=4, drop_rate=0.6)
-                model.load_state_dict(checkpoint, strict=False)
-                print(f"Successfully loaded Alzheimer model with EfficientNet-B3, 4 classes")
-                model.to(device)
-                model.eval()
-                return model
-            except Exception as e:
-                print(f"Error loading Alzheimer model: {e}")
-                import traceback
-                traceback.print_exc()
-                return None
-            
-        elif subtype == "neuro_ms":
-            try:
-                # Load ConvNeXt Tiny with 2 output classes (Control=0, MS=1)
-                # Matches training: convnext_tiny, pretrained=True, num_classes=2
-                model = timm.create_model('convnext_tiny', pretrained=False, num_classes=2)
-                # Load trained weights
-                model.load_state_dict(checkpoint, strict=False)
-                model.to(device)
-                model.eval()
-                print(f"Successfully loaded neuro_ms model with ConvNeXt Tiny")
-                return model
-            except Exception as e:
-                print(f"Error loading neuro_ms model: {e}")
-                import traceback
-                traceback.print_exc()
-                return None
+# MODEL_SHARDS spreads the final models over the worker processes, e.g.
+# "cancer_breast,cancer_colon;cancer_lung;neuro_alzheimers,neuro_ms" for three shards. Each worker
+# loads only its own shard and runs the other final models on the workers hosting them, over Unix
+# sockets in SHARD_SOCKET_DIR. While a shard's worker is down, its models are loaded locally.
+MODEL_SHARDS = parse_shards(os.environ.get("MODEL_SHARDS", ""))
+SHARD_SOCKET_DIR = os.environ.get("SHARD_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "cnd-model-shards"))
+model_shards = ModelShards(MODEL_SHARDS, SHARD_SOCKET_DIR, load_local=final_models.get,
+                           evict_local=final_models.evict,
+                           forward=lambda name, model, tensor: forward(name, model, tensor.to(device))) \
+    if MODEL_SHARDS else None
 
-        elif subtype == "cancer_lung":
-            try:
-                from torchvision import models
-                # Load EfficientNet-B0 with 3 classes (Benign, Malignant, Normal)
-                # Matches training: models.efficientnet_b0(pretrained=True) + 3 class head
-                model = models.efficientnet_b0(pretrained=False)
-                # Replace classifier for 3 classes
-                num_features = model.classifier[1].in_features
-                model.classifier[1] = nn.Linear(num_features, 3)
-
-                # Load checkpoint weights
-                model.load_state_dict(checkpoint, strict=False)
-
-                model.to(device)
-                model.eval()
-                print(f"Successfully loaded Lung model with torchvision EfficientNet-B0, 3 classes")
-                return model
-            except Exception as e:
-                print(f"Error loading lung cancer model: {e}")
-                import traceback
-                traceback.print_exc()
-                return None
+def get_final_model(subtype):
+    """The final model for `subtype` - with MODEL_SHARDS, a stand-in for it when another worker hosts it"""
+    if model_shards is not None:
+        return model_shards.model(subtype)
+    return final_models.get(subtype)
 
-            
-        elif subtype == "cancer_breast":
-            # ResNet18 (confirmed from checkpoint - fc has 512 features)
-            model = models.resnet18(weights=None)
-            model.fc = nn.Linear(model.fc.in_features, 2)
-            model.load_state_dict(checkpoint, strict=False)
-            
-        elif subtype == "cancer_colon":
-            model = models.resnet18(weights=None)
-            num_ftrs = model.fc.in_features
-            model.fc = nn.Sequential(
-                nn.Dropout(0.4),  # dropout to reduce overfitting
-                nn.Linear(num_ftrs, 2)
-            )
+# Set WARMUP_FINAL_MODELS=1 to load the final models at startup rather than on first request
+# (with MODEL_SHARDS each worker loads its own shard when it starts instead)
+if os.environ.get("WARMUP_FINAL_MODELS", "0") == "1" and model_shards is None:
+    for warmup_subtype in list(subtype_to_model)[:FINAL_MODEL_CACHE_SIZE]:
+        # final_models keeps the model - the loader only tracks readiness
+        model_loader.submit(warmup_subtype, lambda s=warmup_subtype: final_models.get(s), keep=False)
 
-            # Load checkpoint weights non-strictly to allow partial loading
-            model_state = model.state_dict()
-            for k in checkpoint:
-                if k in model_state and model_state[k].shape == checkpoint[k].shape:
-                    model_state[k] = checkpoint[k]
-            model.load_state_dict(model_state)
+# ---- Early exit ----
+# /pipeline and /batch run stage 3 before stage 2. With EARLY_EXIT=1, stage 2 is skipped when
+# the subtypes of one group (cancer or neurological) hold at least EARLY_EXIT_CONFIDENCE of the
+# stage 3 softmax, and the classification is that group. Scans below the threshold still run
+# every stage and get the same results. /cascade/stats reports how often each exit is taken.
+EARLY_EXIT = os.environ.get("EARLY_EXIT", "0") == "1"
+EARLY_EXIT_CONFIDENCE = float(os.environ.get("EARLY_EXIT_CONFIDENCE", 0.95))
+cascade_stats = CascadeStats(EARLY_EXIT_CONFIDENCE)
 
-            model = model.to(device)
-            model.eval()
+# ---- Result cache ----
+# Results are cached by a hash of the decoded image (or CSV bytes) so re-submitted scans and the
+# same image sent to several endpoints don't run the CNNs again. The cache is cleared, and every
+# model reloaded, whenever a model file under AI-Models/ changes. The serving configuration is part
+# of the fingerprint too, so results kept on disk (RESULT_CACHE_PATH) across restarts are only
+# reused by a server that would compute them the same way.
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 3600))
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", 64))
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH") or None
 
+# Bump when a code change alters the results computed from the same model files
+RESULT_VERSION = 1
+SERVING_CONFIG = {
+    "results": RESULT_VERSION,
+    "backend": INFERENCE_BACKEND,
+    "quantized": sorted(QUANTIZED_MODELS),
+    "cpu_profile": sorted(CPU_PROFILE_MODELS),
+    "cpu_profile_compile": CPU_PROFILE_COMPILE,
+    "early_exit": EARLY_EXIT,
+    "early_exit_confidence": EARLY_EXIT_CONFIDENCE,
+}
 
-            
-        else:
-            print(f"Unknown subtype: {subtype}")
-            return None
-        
-        model.to(device)
-        model.eval()
-        print(f"Successfully loaded {subtype} model")
-        return model
-        
-    except Exception as e:
-        print(f"Error loading model for {subtype}: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+def reload_models():
+    """Drop the final models (loaded again on next use) and reload the others in the background"""
+    final_models.clear()
+    model_loader.reload()
+
+result_cache = None
+if RESULT_CACHE:
+    result_cache = ResultCache(lambda: model_fingerprint("./AI-Models", config=SERVING_CONFIG),
+                               max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024), ttl=RESULT_CACHE_TTL,
+                               disk_path=RESULT_CACHE_PATH, on_invalidate=reload_models)
+
+def cached_result(key, compute):
+    """Return the cached result for `key`, or compute and cache it. None results are not cached."""
+    if result_cache is None:
+        return compute()
+    value = result_cache.get(key)
+    if value is None:
+        fingerprint = result_cache.fingerprint
+        value = compute()
+        if value is not None:
+            result_cache.set(key, value, fingerprint=fingerprint)
+    return value
+
+def image_digest(image):
+    """Content hash of a decoded image"""
+    return content_digest(f"{image.mode}:{image.size}".encode(), image.tobytes())
+
+def stream_digest(stream):
+    """Content hash of an uploaded file, leaving the stream rewound"""
+    parts = iter(lambda: stream.read(1024 * 1024), b"")
+    digest = content_digest(*parts)
+    stream.seek(0)
+    return digest
 
-# Original transform for pipelines 1 & 2
-transform_normal = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485,0.456,0.406], std=[0.229,0.224,0.225]),
-])
-
-# Transform matching your Colab for pipeline 3
-transform_subtype = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    # include normalization if used in training
-])
-
-# Transform for MS model (matches notebook training: mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-transform_ms = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-])
-
-# Transform for Lung model (same as MS - matches CTlung notebook training)
-transform_lung = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-])
-
-# Transform for Colon model (matches Colon_CT_Resnet18 notebook training)
-transform_colon = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-])
+# Model inputs are built by preprocessing.py: each upload is decoded and resized once, and the
+# input tensor of every stage (normalized the way its model was trained) is computed from that
+# shared buffer. JPEG_DRAFT_DECODE=1 decodes large JPEGs at a reduced scale: faster, but the pixels
+# (and so the model outputs) differ slightly from the full decode, so it is off by default.
+JPEG_DRAFT_DECODE = os.environ.get("JPEG_DRAFT_DECODE", "0") == "1"
 
 reference_csv_path = "./balanced_test_data.csv"
-# Make CSV validation optional if reference file doesn't exist
-if os.path.exists(reference_csv_path):
-    reference_cols = list(pd.read_csv(reference_csv_path, nrows=1).columns)
-    expected_col_count = len(reference_cols)
-else:
-    reference_cols = []
-    expected_col_count = 0
-
-def validate_image_file(temp_path):
+# Make CSV validation optional if reference file doesn't exist. Uploads are checked against the
+# reference header only (eeg.CsvSchema) - the rows are parsed once, when the model reads them.
+reference_schema = eeg.CsvSchema.from_csv(reference_csv_path) if os.path.exists(reference_csv_path) else None
+
+def validate_image_file(source):
     """
     Validate that the file is actually a valid image, not just by extension.
     Returns (success: bool, image: PIL.Image or None, error_message: str or None)
     """
     try:
-        # Try to open and verify the image
-        image = Image.open(temp_path)
-        image.verify()  # Verify it's a valid image
-        # Reopen after verify (verify() closes the file)
-        image = Image.open(temp_path).convert("RGB")
+        # Open and fully decode once - convert() forces the decode, so corrupted or
+        # truncated files fail here without a separate verify() pass and reopen
+        with stage("decode"):
+            image = decode_image(source, draft=JPEG_DRAFT_DECODE)
         return True, image, None
     except Exception as e:
         return False, None, f"Invalid or corrupted image file: {str(e)}"
 
 def is_valid_csv(file):
-    if expected_col_count == 0:
-        # No reference file, accept any CSV
-        try:
-            df = pd.read_csv(file, nrows=5)
-            return True
-        except:
-            return False
+    """Checks the header line only"""
     try:
-        df = pd.read_csv(file, nrows=5)
-        if len(df.columns) != expected_col_count:
-            print("CSV column count mismatch:", len(df.columns), "expected:", expected_col_count)
-            return False
-        if set(df.columns) != set(reference_cols):
-            print("CSV column headers mismatch.")
-            return False
-        return True
-    except Exception as e:
+        header = eeg.read_header(file)
+    except (csv.Error, UnicodeDecodeError, OSError) as e:
         print("CSV validation error:", e)
         return False
+    if not header:
+        return False
+    if reference_schema is None:
+        # No reference file, accept any CSV
+        return True
+    if len(header) != len(reference_schema.columns):
+        print("CSV column count mismatch:", len(header), "expected:", len(reference_schema.columns))
+        return False
+    if not reference_schema.matches(header):
+        print("CSV column headers mismatch.")
+        return False
+    return True
 
-class EpilepsyModel(nn.Module):
-    def __init__(self):
-        super().__init__()
-        self.conv1 = nn.Conv1d(in_channels=1, out_channels=64, kernel_size=3)
-        self.pool1 = nn.MaxPool1d(kernel_size=2)
-        self.conv2 = nn.Conv1d(in_channels=64, out_channels=128, kernel_size=3)
-        self.pool2 = nn.MaxPool1d(kernel_size=2)
-        self.lstm = nn.LSTM(input_size=128, hidden_size=64, batch_first=True)
-        self.dropout = nn.Dropout(0.5)
-        self.fc1 = nn.Linear(64, 64)
-        self.fc2 = nn.Linear(64, 1)
-    def forward(self, x):
-        x = x.permute(0, 2, 1)
-        x = self.conv1(x)
-        x = torch.relu(x)
-        x = self.pool1(x)
-        x = self.conv2(x)
-        x = torch.relu(x)
-        x = self.pool2(x)
-        x = x.permute(0, 2, 1)
-        lstm_out, _ = self.lstm(x)
-        out = lstm_out[:, -1, :]
-        out = self.dropout(out)
-        out = torch.relu(self.fc1(out))
-        out = torch.sigmoid(self.fc2(out))
-        return out.squeeze()
-
-epilepsy_model = EpilepsyModel()
-epilepsy_model.load_state_dict(torch.load("./AI-Models/Epilepsy.pth", map_location=device))
-epilepsy_model.to(device)
-epilepsy_model.eval()
+epilepsy_model = model_loader.submit("epilepsy", lambda: load_served_model("epilepsy", device))
+model_loader.close()
 
 @app.route("/", methods=["GET"])
 def home():
-    return jsonify({"message": "Backend is running"})
+    return jsonify({"message": "Backend is running", **model_loader.status(),
+                    "startup_seconds": APP_IMPORT_SECONDS})
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe - 503 until every model loaded at startup is ready"""
+    status = model_loader.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route("/models/stats", methods=["GET"])
+def model_stats():
+    return jsonify({"final_models": final_models.stats(),
+                    "sharding": model_shards.stats() if model_shards is not None else None,
+                    "cpu_profile": {"models": sorted(CPU_PROFILE_MODELS), "compile": CPU_PROFILE_COMPILE,
+                                    "loaded": cpu_profile_reports}})
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify({"enabled": result_cache is not None,
+                    "results": result_cache.stats() if result_cache is not None else None})
+
+@app.route("/cascade/stats", methods=["GET"])
+def cascade_report():
+    return jsonify({"early_exit": EARLY_EXIT, **cascade_stats.stats()})
+
+@app.route("/batching/stats", methods=["GET"])
+def batching_stats():
+    return jsonify({
+        "enabled": MICRO_BATCHING,
+        "models": {name: batcher.stats() for name, batcher in batchers.items()},
+    })
+
+def model_load_seconds():
+    seconds = {(name,): info["load_seconds"] for name, info in model_loader.status()["models"].items()}
+    seconds.update({(name,): value for name, value in final_models.stats()["load_time_seconds"].items()})
+    return seconds
+
+def cache_counts(field):
+    counts = {("final_models",): final_models.stats()[field]} if field != "disk_hits" else {}
+    if result_cache is not None:
+        counts[("results",)] = result_cache.stats()[field]
+    return counts
+
+metrics.gauge("model_load_seconds", "Time taken to load each model", model_load_seconds, ["model"])
+metrics.gauge("model_ready", "1 once a model loaded at startup is ready",
+              lambda: {(name,): int(info["state"] == "ready") for name, info in model_loader.status()["models"].items()},
+              ["model"])
+metrics.gauge("cache_hits_total", "Cache hits (final model cache and in-memory result cache)",
+              lambda: cache_counts("hits"), ["cache"], kind="counter")
+metrics.gauge("cache_disk_hits_total", "Result cache hits served from the on-disk tier",
+              lambda: cache_counts("disk_hits"), ["cache"], kind="counter")
+metrics.gauge("cache_misses_total", "Cache misses", lambda: cache_counts("misses"), ["cache"], kind="counter")
+metrics.gauge("cache_hit_ratio", "Share of lookups served from the cache", lambda: cache_counts("hit_rate"), ["cache"])
+metrics.gauge("batch_queue_depth", "Requests waiting in each micro-batcher",
+              lambda: {(name,): batcher.stats()["queue_depth"] for name, batcher in batchers.items()}, ["model"])
+metrics.gauge("cascade_exits_total", "Images leaving the cascade at each exit",
+              lambda: {(name,): count for name, count in cascade_stats.stats()["exits"].items()}, ["exit"],
+              kind="counter")
+metrics.gauge("process_resident_memory_bytes", "Resident memory of this process", resident_memory_bytes)
+metrics.gauge("process_peak_resident_memory_bytes", "Peak resident memory of this process",
+              peak_resident_memory_bytes)
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# Large EEG CSVs are read EEG_CHUNK_ROWS rows at a time and run through the model
+# EEG_BATCH_SIZE rows per forward pass, so memory doesn't grow with the recording length
+EEG_CHUNK_ROWS = int(os.environ.get("EEG_CHUNK_ROWS", 2048))
+EEG_BATCH_SIZE = int(os.environ.get("EEG_BATCH_SIZE", 256))
 
 @app.route("/epilepsy", methods=["POST"])
 def epilepsy_predict():
+    """
+    Seizure prediction for each EEG segment (row) of the CSV.
+    With ?stream=1 the per-chunk results are streamed back as NDJSON, followed by a summary line.
+    """
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
     file = request.files['file']
-    filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, filename)
+    stream = (request.args.get('stream') or request.form.get('stream')) == '1'
+    if stream:
+        return epilepsy_stream(file)
     try:
-        file.save(temp_path)
-        df = pd.read_csv(temp_path)
-        exclude_cols = ['y', 'original_row']
-        exclude_cols = [col for col in exclude_cols if col in df.columns]
-        numeric_features = df.select_dtypes(include='number').columns.difference(exclude_cols)
-        features = df[numeric_features].values.astype('float32')
-        tensor_feats = torch.tensor(features).unsqueeze(2).to(device)
-        with torch.no_grad():
-            outputs = epilepsy_model(tensor_feats)
-        pred_probs = outputs.cpu().numpy()
-        if pred_probs.ndim == 0:
-            pred_probs = [pred_probs.item()]
-        results = ["Seizure" if prob >= 0.0001 else "Non-seizure" for prob in pred_probs]
-        os.remove(temp_path)
-        if len(results) == 1:
-            return jsonify({"result": results[0]})
-        else:
-            return jsonify({"results": results})
+        return jsonify(cached_result(f"epilepsy:{stream_digest(file.stream)}", lambda: epilepsy_results(file.stream)))
     except Exception as e:
         print("Epilepsy prediction error:", e)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
 
+def epilepsy_forward(batch):
+    return forward("epilepsy", epilepsy_model, batch)
+
+def epilepsy_results(source):
+    summary = eeg.SeizureSummary()
+    for _, probs in eeg.iter_csv_predictions(source, epilepsy_forward, device, reference_schema,
+                                             chunk_rows=EEG_CHUNK_ROWS, batch_size=EEG_BATCH_SIZE):
+        summary.update(probs)
+    results = [eeg.label(prob) for prob in summary.probabilities]
+    if len(results) == 1:
+        return {"result": results[0], "summary": summary.to_dict()}
+    else:
+        return {"results": results, "summary": summary.to_dict()}
+
+def epilepsy_stream(file):
+    (_, source), = detach_uploads([file])
+
+    def generate():
+        summary = eeg.SeizureSummary(keep_probabilities=False)
+        try:
+            with source:
+                for offset, probs in eeg.iter_csv_predictions(source, epilepsy_forward, device, reference_schema,
+                                                              chunk_rows=EEG_CHUNK_ROWS, batch_size=EEG_BATCH_SIZE):
+                    summary.update(probs)
+                    yield json.dumps({
+                        "offset": offset,
+                        "results": [eeg.label(prob) for prob in probs],
+                        "probabilities": probs.tolist(),
+                    }) + "\n"
+        except Exception as e:
+            print("Epilepsy prediction error:", e)
+            yield json.dumps({"error": str(e)}) + "\n"
+            return
+        yield json.dumps({"summary": summary.to_dict()}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# Continuous recordings (/epilepsy/signal) are cut into overlapping 178-sample windows every
+# EEG_SIGNAL_HOP samples (by default) and scored EEG_SIGNAL_BATCH_SIZE windows per forward pass
+EEG_SIGNAL_HOP = int(os.environ.get("EEG_SIGNAL_HOP", eeg.WINDOW_SAMPLES // 2))
+EEG_SIGNAL_BATCH_SIZE = int(os.environ.get("EEG_SIGNAL_BATCH_SIZE", EEG_BATCH_SIZE))
+
+def signal_params(values, filename):
+    """Signal options from the request (format, column, hop, sample_rate). Raises ValueError when invalid."""
+    signal_format = values.get('format') or ("csv" if filename.lower().endswith(".csv") else "float32")
+    if signal_format not in eeg.SIGNAL_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(eeg.SIGNAL_FORMATS)}")
+    hop = int(values.get('hop') or EEG_SIGNAL_HOP)
+    if not 1 <= hop <= eeg.WINDOW_SAMPLES:
+        raise ValueError(f"hop must be between 1 and {eeg.WINDOW_SAMPLES} samples")
+    sample_rate = float(values.get('sample_rate') or eeg.WINDOW_SAMPLES)
+    if sample_rate <= 0:
+        raise ValueError("sample_rate must be positive")
+    return {"format": signal_format, "column": values.get('column') or None, "hop": hop, "sample_rate": sample_rate}
+
+def iter_signal_results(source, params):
+    """
+    One result per block of windows (their probabilities and the seizure events completed so far),
+    then a final {"events", "summary"} result. Memory doesn't depend on the recording's length.
+    """
+    summary = eeg.SeizureSummary(keep_probabilities=False)
+    events = eeg.SeizureEvents(params["hop"], params["sample_rate"])
+    chunks = eeg.iter_signal_chunks(source, params["format"], params["column"])
+    for first, probs in eeg.iter_signal_predictions(chunks, epilepsy_forward, device, params["hop"],
+                                                    batch_size=EEG_SIGNAL_BATCH_SIZE):
+        summary.update(probs)
+        events.update(first, probs)
+        yield {
+            "first_window": first,
+            "start_seconds": round(first * params["hop"] / params["sample_rate"], 3),
+            "probabilities": probs.tolist(),
+            "events": events.take_finished(),
+        }
+    yield {
+        "events": events.take_finished(final=True),
+        "summary": {**summary.to_dict(), "event_count": events.count, "window": eeg.WINDOW_SAMPLES,
+                    "hop": params["hop"], "sample_rate": params["sample_rate"]},
+    }
+
+@app.route("/epilepsy/signal", methods=["POST"])
+def epilepsy_signal():
+    """
+    Seizure probability timeline and seizure events of a continuous single-channel EEG recording:
+    a CSV column (`column`, by default the first) or raw little-endian float32 samples (`format`).
+    Window i covers samples [i * hop, i * hop + 178). With ?stream=1 the results are streamed
+    back as NDJSON, one line per block of windows, followed by the events and summary.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    file = request.files['file']
+    values = request.values
+    try:
+        params = signal_params(values, file.filename or "")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if values.get('stream') == '1':
+        (_, source), = detach_uploads([file])
+
+        def generate():
+            try:
+                with source:
+                    for result in iter_signal_results(source, params):
+                        yield json.dumps(result) + "\n"
+            except Exception as e:
+                print("Epilepsy signal error:", e)
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    def compute():
+        timeline, events = [], []
+        for result in iter_signal_results(file.stream, params):
+            timeline.extend(result.get("probabilities", []))
+            events.extend(result["events"])
+        return {"timeline": timeline, "events": events, "summary": result["summary"]}
+    try:
+        key = f"epilepsy_signal:{json.dumps(params, sort_keys=True)}:{stream_digest(file.stream)}"
+        return jsonify(cached_result(key, compute))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print("Epilepsy signal error:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+# ---- Micro-batching ----
+# With MICRO_BATCHING=1, concurrent requests for the same model are collected for up to
+# BATCH_MAX_WAIT_MS (or until BATCH_MAX_SIZE images) and run as one batched forward pass.
+MICRO_BATCHING = os.environ.get("MICRO_BATCHING", "0") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+
+def _final_model_forward(subtype):
+    def run(batch):
+        final_model = get_final_model(subtype)
+        if final_model is None:
+            raise RuntimeError(f"Model not found for {subtype}")
+        return final_model(batch)
+    return run
+
+batchers = {}
+if MICRO_BATCHING:
+    batch_model_fns = {
+        "stage1": lambda batch: model_stage1(batch),
+        "stage2": lambda batch: model_stage2(batch),
+        "stage3": lambda batch: model_stage3(batch),
+    }
+    for subtype_name in subtype_to_model:
+        batch_model_fns[subtype_name] = _final_model_forward(subtype_name)
+    for batcher_name, model_fn in batch_model_fns.items():
+        batchers[batcher_name] = MicroBatcher(model_fn, max_batch_size=BATCH_MAX_SIZE,
+                                              max_wait_ms=BATCH_MAX_WAIT_MS, name=batcher_name)
+
+def forward(name, model, tensor):
+    """Run `tensor` through `model`, going through its micro-batcher when batching is enabled"""
+    with stage("forward", name):
+        batcher = batchers.get(name)
+        if batcher is not None:
+            return batcher.submit(tensor)
+        with torch.no_grad():
+            return model(tensor)
+
+# ---- Inference helpers shared by the single-stage routes and /pipeline ----
+# Class labels for each final model, matching training
+diagnosis_labels = {
+    "cancer_lung": ["Benign", "Malignant", "Normal"],
+    "cancer_breast": ["Benign", "Malignant"],
+    "cancer_colon": ["Non_Cancer", "Cancer"],
+    "neuro_ms": ["Control", "MS"],  # Binary: Control vs MS
+}
+
+def modality_batch(tensor):
+    """Stage 1 - returns a (prediction, confidence) pair per image in the batch"""
+    output = forward("stage1", model_stage1, tensor)
+    results = []
+    for value in output.reshape(-1).tolist():
+        confidence = round(float(value), 3)
+        pred = "Our Modality" if confidence < 0.5 else "Not Our Modality"
+        results.append((pred, confidence))
+    return results
+
+def classification_batch(tensor):
+    """Stage 2 - Cancer vs Neurological Disorder for each image in the batch"""
+    probs = forward("stage2", model_stage2, tensor).reshape(-1).tolist()
+    return [class_names_stage2[int(prob > 0.5)] for prob in probs]
+
+def subtype_batch(tensor):
+    """Stage 3 - one of class_names_stage3 for each image in the batch"""
+    output = forward("stage3", model_stage3, tensor)
+    probabilities = torch.softmax(output, dim=1)
+    return [class_names_stage3[idx] for idx in torch.argmax(probabilities, dim=1).tolist()]
+
+def subtype_confidence_batch(tensor):
+    """Stage 3 - (subtype, confidence in its cancer/neuro group) for each image in the batch"""
+    output = forward("stage3", model_stage3, tensor)
+    return group_confidences(torch.softmax(output, dim=1), class_names_stage3)
+
+def diagnosis_label(subtype, pred_class):
+    if subtype == "neuro_alzheimers":
+        # 4-class model: map to binary
+        # Classes: 0=Mild Impairment, 1=Moderate Impairment, 2=No Impairment, 3=Very Mild Impairment
+        # Binary mapping: class 2 -> No Alzheimer, others -> Alzheimer
+        binary_map = {0: 1, 1: 1, 2: 0, 3: 1}  # 0=No Alzheimer, 1=Alzheimer
+        binary_labels = ["No Alzheimer", "Alzheimer"]
+        return binary_labels[binary_map[pred_class]]
+    if subtype in diagnosis_labels:
+        return diagnosis_labels[subtype][pred_class]
+    # Fallback binary handling
+    return "Disease Detected" if pred_class == 1 else "Normal"
+
+def diagnosis_batch(final_model, subtype, tensor):
+    """Final stage - disease-specific diagnosis label for each image in the batch"""
+    output = forward(subtype, final_model, tensor)
+    probabilities = torch.softmax(output, dim=1)
+    return [diagnosis_label(subtype, idx) for idx in torch.argmax(probabilities, dim=1).tolist()]
+
+def run_modality(tensor):
+    return modality_batch(tensor)[0]
+
+def run_classification(tensor):
+    return classification_batch(tensor)[0]
+
+def run_subtype(tensor):
+    return subtype_batch(tensor)[0]
+
+def run_subtype_confidence(tensor):
+    return subtype_confidence_batch(tensor)[0]
+
+def skip_classification(group_confidence):
+    return EARLY_EXIT and group_confidence >= EARLY_EXIT_CONFIDENCE
+
+def run_diagnosis(final_model, subtype, tensor):
+    return diagnosis_batch(final_model, subtype, tensor)[0]
+
+def diagnose_image(subtype, prepared, digest):
+    """
+    Final-stage diagnosis for a PreparedImage, using the disease-specific model (kept resident
+    after its first load). Returns None when the model can't be loaded.
+    """
+    def compute():
+        final_model = get_final_model(subtype)
+        if final_model is None:
+            return None
+        # Use appropriate normalization based on subtype
+        return run_diagnosis(final_model, subtype, prepared.tensor(final_variant(subtype)))
+    return cached_result(f"diagnosis:{subtype}:{digest}", compute)
 
 @app.route("/predict", methods=["POST"])
 def predict():
@@ -348,22 +602,16 @@ def predict():
         return jsonify({"error": "No file uploaded"}), 400
     file = request.files['file']
     filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, filename)
     try:
-        file.save(temp_path)
         if filename.endswith(('.jpg','.jpeg','.png')):
             # Validate it's actually an image file
-            is_valid, image, error_msg = validate_image_file(temp_path)
+            is_valid, image, error_msg = validate_image_file(file.stream)
             if not is_valid:
-                os.remove(temp_path)
                 return jsonify({"error": error_msg}), 400
             
-            tensor = transform_normal(image).unsqueeze(0).to(device)
-            with torch.no_grad():
-                output = model_stage1(tensor)
-                confidence = round(float(output.item()), 3)
-                pred = "Our Modality" if confidence < 0.5 else "Not Our Modality"
-            os.remove(temp_path)
+            pred, confidence = cached_result(
+                f"modality:{image_digest(image)}",
+                lambda: run_modality(PreparedImage(image, device, timer=stage).tensor(NORMAL)))
             
             print(f"Modality prediction: {pred}, confidence: {confidence}")
             
@@ -372,19 +620,14 @@ def predict():
                 return jsonify({"prediction": pred, "isNotOurModality": True}), 200
             return jsonify({"prediction": pred}), 200
         elif filename.endswith(".csv"):
-            if is_valid_csv(temp_path):
-                os.remove(temp_path)
+            if is_valid_csv(file.stream):
                 return jsonify({"prediction": "Our Modality"})
             else:
-                os.remove(temp_path)
                 return jsonify({"error": "Invalid CSV"})
         else:
-            os.remove(temp_path)
             return jsonify({"error": "Unsupported file type"}), 400
     except Exception as e:
         print("Error in /predict:", e)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/classify", methods=["POST"])
@@ -393,30 +636,21 @@ def classify():
         return jsonify({"error": "No file uploaded"}), 400
     file = request.files['file']
     filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, filename)
     try:
-        file.save(temp_path)
         if filename.endswith(('.jpg','.jpeg','.png')):
             # Validate it's actually an image file
-            is_valid, image, error_msg = validate_image_file(temp_path)
+            is_valid, image, error_msg = validate_image_file(file.stream)
             if not is_valid:
-                os.remove(temp_path)
                 return jsonify({"error": error_msg}), 400
             
-            tensor = transform_normal(image).unsqueeze(0).to(device)
-            with torch.no_grad():
-                prob = model_stage2(tensor).item()
-                pred_idx = int(prob > 0.5)
-                label = class_names_stage2[pred_idx]
-            os.remove(temp_path)
+            label = cached_result(
+                f"classification:{image_digest(image)}",
+                lambda: run_classification(PreparedImage(image, device, timer=stage).tensor(NORMAL)))
             return jsonify({"classification": label})
         else:
-            os.remove(temp_path)
             return jsonify({"error": "Only image files supported for classification"}), 400
     except Exception as e:
         print("Classification error:", e)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/subtype", methods=["POST"])
@@ -425,31 +659,21 @@ def subtype():
         return jsonify({"error": "No file uploaded"}), 400
     file = request.files['file']
     filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, filename)
     try:
-        file.save(temp_path)
         if filename.endswith(('.jpg','.jpeg','.png')):
             # Validate it's actually an image file
-            is_valid, image, error_msg = validate_image_file(temp_path)
+            is_valid, image, error_msg = validate_image_file(file.stream)
             if not is_valid:
-                os.remove(temp_path)
                 return jsonify({"error": error_msg}), 400
             
-            tensor = transform_subtype(image).unsqueeze(0).to(device)
-            with torch.no_grad():
-                output = model_stage3(tensor)
-                probabilities = torch.softmax(output, dim=1)[0]
-                pred_idx = torch.argmax(probabilities).item()
-                label = class_names_stage3[pred_idx]
-            os.remove(temp_path)
+            label = cached_result(
+                f"subtype:{image_digest(image)}",
+                lambda: run_subtype(PreparedImage(image, device, timer=stage).tensor(SUBTYPE)))
             return jsonify({"subtype_prediction": label})
         else:
-            os.remove(temp_path)
             return jsonify({"error": "Only image files supported for subtype classification"}), 400
     except Exception as e:
         print("Subtype error:", e)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/diagnose", methods=["POST"])
@@ -468,84 +692,449 @@ def diagnose():
     
     file = request.files['file']
     filename = secure_filename(file.filename)
-    temp_path = os.path.join(UPLOAD_FOLDER, filename)
     
     try:
-        file.save(temp_path)
         if filename.endswith(('.jpg','.jpeg','.png')):
-            # Load disease-specific model
-            final_model = load_final_model(subtype, device)
-            if final_model is None:
-                os.remove(temp_path)
-                return jsonify({"error": f"Model not found for {subtype}"}), 500
-            
             # Validate it's actually an image file
-            is_valid, image, error_msg = validate_image_file(temp_path)
+            is_valid, image, error_msg = validate_image_file(file.stream)
             if not is_valid:
-                os.remove(temp_path)
                 return jsonify({"error": error_msg}), 400
             
-            # Use appropriate transform based on subtype
-            if subtype == "neuro_ms":
-                # MS model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]
-                tensor = transform_ms(image).unsqueeze(0).to(device)
-            elif subtype == "cancer_lung":
-                # Lung model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]
-                tensor = transform_lung(image).unsqueeze(0).to(device)
-            elif subtype == "cancer_colon":
-                # Colon model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]
-                tensor = transform_colon(image).unsqueeze(0).to(device)
-            else:
-                # Other models (Breast, Alzheimer) use ImageNet normalization
-                tensor = transform_normal(image).unsqueeze(0).to(device)
-            
-            with torch.no_grad():
-                output = final_model(tensor)
-                # Handle different output formats based on subtype
-                probabilities = torch.softmax(output, dim=1)[0]
-                pred_class = torch.argmax(probabilities).item()
-                
-                # Define class labels for each subtype matching training
-                if subtype == "cancer_lung":
-                    lung_labels = ["Benign", "Malignant", "Normal"]
-                    diagnosis = lung_labels[pred_class]
-                elif subtype == "cancer_breast":
-                    breast_labels = ["Benign", "Malignant"]
-                    diagnosis = breast_labels[pred_class]
-                elif subtype == "cancer_colon":
-                    colon_labels = ["Non_Cancer", "Cancer"]
-                    diagnosis = colon_labels[pred_class]
-                elif subtype == "neuro_alzheimers":
-                    # 4-class model: map to binary
-                    # Classes: 0=Mild Impairment, 1=Moderate Impairment, 2=No Impairment, 3=Very Mild Impairment
-                    # Binary mapping: class 2 -> No Alzheimer, others -> Alzheimer
-                    binary_map = {0: 1, 1: 1, 2: 0, 3: 1}  # 0=No Alzheimer, 1=Alzheimer
-                    pred_binary = binary_map[pred_class]
-                    binary_labels = ["No Alzheimer", "Alzheimer"]
-                    diagnosis = binary_labels[pred_binary]
-                elif subtype == "neuro_ms":
-                    # Binary: Control vs MS
-                    ms_labels = ["Control", "MS"]
-                    diagnosis = ms_labels[pred_class]
-                else:
-                    # Fallback binary handling
-                    diagnosis = "Disease Detected" if pred_class == 1 else "Normal"
-
+            diagnosis = diagnose_image(subtype, PreparedImage(image, device, timer=stage), image_digest(image))
+            if diagnosis is None:
+                return jsonify({"error": f"Model not found for {subtype}"}), 500
             
-            os.remove(temp_path)
             return jsonify({
                 "diagnosis": diagnosis,
                 "subtype": subtype
             })
         else:
-            os.remove(temp_path)
             return jsonify({"error": "Only image files supported for diagnosis"}), 400
     except Exception as e:
         print("Diagnosis error:", e)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/pipeline", methods=["POST"])
+def pipeline():
+    """
+    Full image pipeline (modality -> classification -> subtype -> diagnosis) for one upload.
+    The file is received, decoded and resized once and the stage tensors are shared, instead of
+    the client sending the same image to /predict, /classify, /subtype and /diagnose.
+    """
+    timings = {}
+    # The body was already received and parsed by start_request_metrics, so time from the start of the request
+    started = g.get("request_started", time.perf_counter())
+
+    def lap(stage, since):
+        now = time.perf_counter()
+        timings[stage] = round((now - since) * 1000, 2)
+        return now
+
+    if 'file' not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    file = request.files['file']
+    filename = secure_filename(file.filename)
+    if not filename.endswith(('.jpg','.jpeg','.png')):
+        return jsonify({"error": "Only image files supported for the pipeline"}), 400
+
+    try:
+        t = lap("upload", started)
+        is_valid, image, error_msg = validate_image_file(file.stream)
+        if not is_valid:
+            return jsonify({"error": error_msg}), 400
+        digest = image_digest(image)
+        t = lap("decode", t)
+
+        # Tensors are only built if a stage actually has to run (not cached)
+        prepared = PreparedImage(image, device, timer=stage)
+
+        pred, confidence = cached_result(f"modality:{digest}", lambda: run_modality(prepared.tensor(NORMAL)))
+        t = lap("modality", t)
+        result = {"prediction": pred, "confidence": confidence, "timings_ms": timings}
+        if pred == "Not Our Modality":
+            cascade_stats.record(NOT_OUR_MODALITY)
+            result["isNotOurModality"] = True
+            timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+            return jsonify(result), 200
+
+        subtype_label, group_confidence = cached_result(
+            f"subtype_confidence:{digest}", lambda: run_subtype_confidence(prepared.tensor(SUBTYPE)))
+        result["subtype_prediction"] = subtype_label
+        t = lap("subtype", t)
+        if skip_classification(group_confidence):
+            result["classification"] = subtype_group(subtype_label)
+            cascade_stats.record(CONFIDENT_SUBTYPE)
+        else:
+            result["classification"] = cached_result(f"classification:{digest}",
+                                                     lambda: run_classification(prepared.tensor(NORMAL)))
+            t = lap("classification", t)
+            cascade_stats.record(FULL)
+            cascade_stats.record_agreement(subtype_label, group_confidence, result["classification"])
+
+        diagnosis = diagnose_image(subtype_label, prepared, digest)
+        if diagnosis is None:
+            return jsonify({"error": f"Model not found for {subtype_label}"}), 500
+        result["diagnosis"] = diagnosis
+        result["subtype"] = subtype_label
+        lap("diagnosis", t)
+        timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+        return jsonify(result), 200
+    except Exception as e:
+        print("Pipeline error:", e)
+        return jsonify({"error": str(e)}), 500
+
+
+# ---- Bulk screening ----
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+# Images are decoded and run through the models BATCH_CHUNK_SIZE at a time, so memory
+# stays bounded however many images the archive holds
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 32))
+BATCH_DECODE_WORKERS = int(os.environ.get("BATCH_DECODE_WORKERS", min(4, os.cpu_count() or 1)))
+decode_pool = ThreadPoolExecutor(max_workers=BATCH_DECODE_WORKERS, thread_name_prefix="decode")
+
+def detach_uploads(files):
+    """
+    Take over the streams of uploaded files as (filename, stream) pairs. Flask closes
+    request.files when the view returns, which is before a streamed response is generated.
+    """
+    uploads = []
+    for file in files:
+        uploads.append((file.filename or "", file.stream))
+        file.stream = io.BytesIO()
+    return uploads
+
+def iter_upload_images(uploads):
+    """Yield (filename, bytes) for each (filename, stream) upload, expanding zip/tar archives one member at a time"""
+    for name, stream in uploads:
+        with stream:
+            yield from _iter_upload(name, stream)
+
+def _iter_upload(name, stream):
+    lower = name.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                    continue
+                if info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield info.filename, archive.read(info)
+    elif lower.endswith(TAR_EXTENSIONS):
+        # Streaming mode - members are read in order without seeking
+        with tarfile.open(fileobj=stream, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        yield name, stream.read()
+
+def _decode_batch_item(item):
+    index, name, data = item
+    row = {"index": index, "filename": name}
+    if not name.lower().endswith(IMAGE_EXTENSIONS):
+        row["error"] = "Unsupported file type"
+        return row, None
+    is_valid, image, error_msg = validate_image_file(io.BytesIO(data))
+    if not is_valid:
+        row["error"] = error_msg
+        return row, None
+    prepared = PreparedImage(image)
+    prepared.pixels(SQUARE)
+    return row, prepared
+
+def _screen_chunk(chunk):
+    """Run one chunk of (index, filename, bytes) through the full pipeline, yielding result rows"""
+    decoded = []
+    for row, prepared in decode_pool.map(_decode_batch_item, chunk):
+        if prepared is None:
+            yield row
+        else:
+            decoded.append((row, prepared))
+    if not decoded:
+        return
+
+    tensor_normal = batch_tensor([prepared for _, prepared in decoded], NORMAL).to(device)
+    keep = []
+    for i, (pred, confidence) in enumerate(modality_batch(tensor_normal)):
+        row = decoded[i][0]
+        row["prediction"] = pred
+        row["confidence"] = confidence
+        if pred == "Not Our Modality":
+            row["isNotOurModality"] = True
+            yield row
+        else:
+            keep.append(i)
+    cascade_stats.record(NOT_OUR_MODALITY, len(decoded) - len(keep))
+    if not keep:
+        return
+
+    tensor_normal = tensor_normal[keep]
+    decoded = [decoded[i] for i in keep]
+    images = [prepared for _, prepared in decoded]
+    # The center-crop resize runs on the decode pool, the conversion to a tensor once for the chunk
+    list(decode_pool.map(lambda prepared: prepared.pixels(CENTER_CROP), images))
+    tensor_subtype = batch_tensor(images, SUBTYPE).to(device)
+    groups = {}
+    uncertain = []
+    for i, (label, group_confidence) in enumerate(subtype_confidence_batch(tensor_subtype)):
+        row = decoded[i][0]
+        row["classification"] = None  # set below, keeps the field order of the rows
+        row["subtype_prediction"] = label
+        groups.setdefault(label, []).append(i)
+        if skip_classification(group_confidence):
+            row["classification"] = subtype_group(label)
+        else:
+            uncertain.append((i, group_confidence))
+    cascade_stats.record(CONFIDENT_SUBTYPE, len(decoded) - len(uncertain))
+    cascade_stats.record(FULL, len(uncertain))
+    # Stage 2 only runs on the images stage 3 wasn't confident about
+    if uncertain:
+        indices = [i for i, _ in uncertain]
+        for (i, group_confidence), label in zip(uncertain, classification_batch(tensor_normal[indices])):
+            row = decoded[i][0]
+            row["classification"] = label
+            cascade_stats.record_agreement(row["subtype_prediction"], group_confidence, label)
+
+    # One forward pass per final model over every image predicted as that subtype
+    for subtype_label, indices in groups.items():
+        final_model = get_final_model(subtype_label)
+        if final_model is None:
+            for i in indices:
+                decoded[i][0]["error"] = f"Model not found for {subtype_label}"
+                yield decoded[i][0]
+            continue
+        variant = final_variant(subtype_label)
+        if variant == NORMAL:
+            tensor_final = tensor_normal[indices]
+        else:
+            # Same 224x224 pixels as the stage 1/2 input, only normalized differently
+            tensor_final = batch_tensor([images[i] for i in indices], variant).to(device)
+        for i, diagnosis in zip(indices, diagnosis_batch(final_model, subtype_label, tensor_final)):
+            decoded[i][0]["diagnosis"] = diagnosis
+            decoded[i][0]["subtype"] = subtype_label
+            yield decoded[i][0]
+
+def new_batch_summary():
+    return {"total": 0, "errors": 0, "not_our_modality": 0, "diagnoses": {}}
+
+def add_to_batch_summary(summary, row):
+    summary["total"] += 1
+    if "error" in row:
+        summary["errors"] += 1
+    elif row.get("isNotOurModality"):
+        summary["not_our_modality"] += 1
+    else:
+        counts = summary["diagnoses"].setdefault(row["subtype"], {})
+        counts[row["diagnosis"]] = counts.get(row["diagnosis"], 0) + 1
+
+def screen_images(items):
+    """Run every (filename, bytes) in `items` through the full pipeline, yielding one result row per image"""
+    chunk = []
+    for index, (name, data) in enumerate(items):
+        chunk.append((index, name, data))
+        if len(chunk) >= BATCH_CHUNK_SIZE:
+            yield from _screen_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from _screen_chunk(chunk)
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    """
+    Bulk screening - accepts any number of images and/or zip/tar archives of images and
+    streams one JSON result per line (NDJSON) as each chunk finishes, followed by a summary line.
+    """
+    files = [f for key in request.files for f in request.files.getlist(key)]
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    uploads = detach_uploads(files)
+
+    def generate():
+        started = time.perf_counter()
+        summary = new_batch_summary()
+        try:
+            for row in screen_images(iter_upload_images(uploads)):
+                add_to_batch_summary(summary, row)
+                yield json.dumps(row) + "\n"
+        except Exception as e:
+            print("Batch error:", e)
+            summary["error"] = str(e)
+        summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# ---- Background jobs ----
+# POST /jobs queues an EEG CSV or a set of images/archives and returns a job id straight away, so
+# long analyses don't hold a request open. JOB_WORKERS jobs run at a time (across all gunicorn
+# workers) on background threads. The queue and uploads are kept under JOBS_DIR (SQLite + files),
+# so queued jobs and jobs interrupted by a restart are picked up again when the server comes back.
+JOBS_DIR = os.environ.get("JOBS_DIR", "./jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", 100))
+JOB_RETENTION_HOURS = float(os.environ.get("JOB_RETENTION_HOURS", 24))
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(1024 * 1024), b""))
+
+def run_epilepsy_job(job):
+    (_, path), = job.inputs()
+    total = max(count_lines(path) - 1, 0)
+    summary = eeg.SeizureSummary(keep_probabilities=False)
+    with open(path, "rb") as source:
+        for offset, probs in eeg.iter_csv_predictions(source, epilepsy_forward, device, reference_schema,
+                                                      chunk_rows=EEG_CHUNK_ROWS, batch_size=EEG_BATCH_SIZE):
+            summary.update(probs)
+            job.emit([{
+                "offset": offset,
+                "results": [eeg.label(prob) for prob in probs],
+                "probabilities": probs.tolist(),
+            }], processed=offset + len(probs), total=total)
+    return summary.to_dict()
+
+def signal_sample_count(path, signal_format):
+    if signal_format == "float32":
+        return os.path.getsize(path) // 4
+    return max(count_lines(path) - 1, 0)
+
+def run_epilepsy_signal_job(job):
+    (_, path), = job.inputs()
+    params = job.params["signal"]
+    samples = signal_sample_count(path, params["format"])
+    total = max((samples - eeg.WINDOW_SAMPLES) // params["hop"] + 1, 0)
+    with open(path, "rb") as source:
+        for result in iter_signal_results(source, params):
+            if "summary" in result:
+                if result["events"]:
+                    job.emit([{"events": result["events"]}])
+                return result["summary"]
+            job.emit([result], processed=result["first_window"] + len(result["probabilities"]), total=total)
+
+def count_upload_images(name, path):
+    """Images in an upload, or None when that would mean reading all of it (tar archives)"""
+    lower = name.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for info in archive.infolist()
+                       if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+                       and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+    if lower.endswith(TAR_EXTENSIONS):
+        return None
+    return 1
+
+def run_batch_job(job):
+    inputs = job.inputs()
+    counts = [count_upload_images(name, path) for name, path in inputs]
+    total = None if None in counts else sum(counts)
+    started = time.perf_counter()
+    summary = new_batch_summary()
+    rows = []
+    # Each input is opened only when the screening reaches it, and iter_upload_images closes it once
+    # read - closing the generator also closes the one in use if the batch fails part way
+    images = iter_upload_images((name, open(path, "rb")) for name, path in inputs)
+    with closing(images):
+        for row in screen_images(images):
+            add_to_batch_summary(summary, row)
+            rows.append(row)
+            if len(rows) >= BATCH_CHUNK_SIZE:
+                job.emit(rows, processed=summary["total"], total=total)
+                rows = []
+    job.emit(rows, processed=summary["total"], total=summary["total"])
+    summary["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return summary
+
+job_queue = JobQueue(JOBS_DIR, {"epilepsy": run_epilepsy_job, "epilepsy_signal": run_epilepsy_signal_job,
+                                "batch": run_batch_job},
+                     max_running=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, retention=JOB_RETENTION_HOURS * 3600)
+
+def start_worker_threads():
+    """
+    Start the job workers and the model shard server of this process. Not done at import: with
+    gunicorn's preload the app is imported in the master, and threads don't survive the fork.
+    """
+    job_queue.start()
+    if model_shards is not None:
+        model_shards.start()
+
+@app.before_request
+def ensure_worker_threads():
+    # Also started by gunicorn.conf.py as each worker boots, so interrupted jobs resume without a request
+    start_worker_threads()
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """
+    Queue a long-running analysis and return 202 with its id. kind=epilepsy takes one EEG CSV as
+    `file`; kind=epilepsy_signal takes one continuous recording and the options of /epilepsy/signal;
+    kind=batch takes any number of images and/or zip/tar archives like /batch.
+    """
+    kind = request.args.get('kind') or request.form.get('kind')
+    if kind not in job_queue.handlers:
+        return jsonify({"error": f"kind must be one of: {', '.join(job_queue.handlers)}"}), 400
+    files = [f for key in request.files for f in request.files.getlist(key)]
+    if not files:
+        return jsonify({"error": "No file uploaded"}), 400
+    if kind == "epilepsy" and len(files) != 1:
+        return jsonify({"error": "An epilepsy job takes a single CSV file"}), 400
+    params = None
+    if kind == "epilepsy_signal":
+        if len(files) != 1:
+            return jsonify({"error": "An epilepsy_signal job takes a single recording"}), 400
+        try:
+            params = {"signal": signal_params(request.values, files[0].filename or "")}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    job_id = job_queue.submit(kind, [(f.filename or "", f.stream) for f in files], params)
+    if job_id is None:
+        return jsonify({"error": "Too many queued jobs, please retry later"}), 429
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "results_url": f"/jobs/{job_id}/results",
+    }), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/results", methods=["GET"])
+def job_results(job_id):
+    """
+    Results of a job, including the partial results of a running one. Page through them with
+    ?offset=<next_offset>; `complete` is true once the job finished and everything has been read.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+    results = job_queue.results(job_id, offset, limit)
+    next_offset = offset + len(results)
+    response = {
+        "job_id": job_id,
+        "status": job["status"],
+        "results": results,
+        "next_offset": next_offset,
+        "complete": job["status"] in ("done", "failed") and next_offset >= job["result_count"],
+    }
+    for field in ("summary", "error"):
+        if field in job:
+            response[field] = job[field]
+    return jsonify(response)
+
+metrics.gauge("jobs", "Background jobs in each status",
+              lambda: {(status,): count for status, count in job_queue.counts().items()}, ["status"])
+
+
+# Time from the start of this module until the app can serve requests (models may still be loading)
+APP_IMPORT_SECONDS = round(time.perf_counter() - APP_STARTED, 3)
+print(f"App ready to serve {APP_IMPORT_SECONDS}s after startup")
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5001)
+    # Development server - use `gunicorn -c gunicorn.conf.py wsgi:app` in production
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=5001)
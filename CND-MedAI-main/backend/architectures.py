@@ -0,0 +1,125 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# Architectures of every pipeline model, without weights. model_loading.py loads the .pth
+# checkpoints into these; the export/benchmark tools build them directly.
+
+
+class SimpleCNN(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv1 = nn.Conv2d(3, 32, 3, padding=1)
+        self.pool = nn.MaxPool2d(2, 2)
+        self.conv2 = nn.Conv2d(32, 64, 3, padding=1)
+        self.fc1 = nn.Linear(64 * 56 * 56, 128)
+        self.fc2 = nn.Linear(128, 1)
+    def forward(self, x):
+        x = self.pool(F.relu(self.conv1(x)))
+        x = self.pool(F.relu(self.conv2(x)))
+        x = x.view(-1, 64 * 56 * 56)
+        x = F.relu(self.fc1(x))
+        x = torch.sigmoid(self.fc2(x))
+        return x
+
+
+class EpilepsyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv1 = nn.Conv1d(in_channels=1, out_channels=64, kernel_size=3)
+        self.pool1 = nn.MaxPool1d(kernel_size=2)
+        self.conv2 = nn.Conv1d(in_channels=64, out_channels=128, kernel_size=3)
+        self.pool2 = nn.MaxPool1d(kernel_size=2)
+        self.lstm = nn.LSTM(input_size=128, hidden_size=64, batch_first=True)
+        self.dropout = nn.Dropout(0.5)
+        self.fc1 = nn.Linear(64, 64)
+        self.fc2 = nn.Linear(64, 1)
+    def forward(self, x):
+        x = x.permute(0, 2, 1)
+        x = self.conv1(x)
+        x = torch.relu(x)
+        x = self.pool1(x)
+        x = self.conv2(x)
+        x = torch.relu(x)
+        x = self.pool2(x)
+        x = x.permute(0, 2, 1)
+        lstm_out, _ = self.lstm(x)
+        out = lstm_out[:, -1, :]
+        out = self.dropout(out)
+        out = torch.relu(self.fc1(out))
+        out = torch.sigmoid(self.fc2(out))
+        return out.squeeze()
+
+
+def build_stage2():
+    """ResNet18 - Cancer vs Neurological Disorder"""
+    from torchvision import models
+    model2 = models.resnet18(weights=None)
+    model2.fc = nn.Sequential(
+        nn.Dropout(0.5),
+        nn.Linear(model2.fc.in_features, 1),
+        nn.Sigmoid()
+    )
+    return model2
+
+
+def build_stage3():
+    """EfficientNet-B0 - 5 subtypes"""
+    import timm
+    return timm.create_model('efficientnet_b0', pretrained=False, num_classes=5)
+
+
+def build_final_model(subtype):
+    """Architecture of the disease-specific final diagnostic model, or None for an unknown subtype"""
+    from torchvision import models
+    if subtype == "neuro_alzheimers":
+        # EfficientNet-B3 with 4 classes (matches notebook training)
+        # Classes: Mild Impairment, Moderate Impairment, No Impairment, Very Mild Impairment
+        import timm
+        return timm.create_model('efficientnet_b3', pretrained=False, num_classes=4, drop_rate=0.6)
+    elif subtype == "neuro_ms":
+        # ConvNeXt Tiny with 2 output classes (Control=0, MS=1)
+        # Matches training: convnext_tiny, pretrained=True, num_classes=2
+        import timm
+        return timm.create_model('convnext_tiny', pretrained=False, num_classes=2)
+    elif subtype == "cancer_lung":
+        # EfficientNet-B0 with 3 classes (Benign, Malignant, Normal)
+        # Matches training: models.efficientnet_b0(pretrained=True) + 3 class head
+        model = models.efficientnet_b0(weights=None)
+        num_features = model.classifier[1].in_features
+        model.classifier[1] = nn.Linear(num_features, 3)
+        return model
+    elif subtype == "cancer_breast":
+        # ResNet18 (confirmed from checkpoint - fc has 512 features)
+        model = models.resnet18(weights=None)
+        model.fc = nn.Linear(model.fc.in_features, 2)
+        return model
+    elif subtype == "cancer_colon":
+        model = models.resnet18(weights=None)
+        num_ftrs = model.fc.in_features
+        model.fc = nn.Sequential(
+            nn.Dropout(0.4),  # dropout to reduce overfitting
+            nn.Linear(num_ftrs, 2)
+        )
+        return model
+    return None
+
+
+def build_model(name):
+    """Architecture for a pipeline model name: stage1, stage2, stage3, epilepsy or a subtype"""
+    if name == "stage1":
+        return SimpleCNN()
+    if name == "stage2":
+        return build_stage2()
+    if name == "stage3":
+        return build_stage3()
+    if name == "epilepsy":
+        return EpilepsyModel()
+    return build_final_model(name)
+
+
+def example_input(name, batch_size=1):
+    """Random input with the shape the named model is served with"""
+    if name == "epilepsy":
+        return torch.randn(batch_size, 178, 1)
+    return torch.randn(batch_size, 3, 224, 224)
@@ -0,0 +1,190 @@
+"""
+Async (ASGI) entry point for the inference service:
+
+    pip install uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+Uploads are received on the event loop, so a slow client doesn't tie up a thread. The Flask
+routes from app.py then run on a bounded pool of ASGI_INFERENCE_WORKERS threads. At most
+ASGI_QUEUE_SIZE more requests wait for a thread. Anything beyond that is rejected straight away
+with 429 and a Retry-After header, before its body is read. Health, readiness, metrics and stats
+routes run on their own small pool and skip the queue, so they stay responsive under load.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app, metrics, start_worker_threads, UPLOAD_SPOOL_MAX_BYTES
+
+ASGI_INFERENCE_WORKERS = int(os.environ.get("ASGI_INFERENCE_WORKERS", 4))
+ASGI_QUEUE_SIZE = int(os.environ.get("ASGI_QUEUE_SIZE", 16))
+ASGI_RETRY_AFTER = int(os.environ.get("ASGI_RETRY_AFTER", 2))
+# Cheap routes that never wait behind inference
+LIGHT_PATHS = {"/", "/ready", "/metrics", "/models/stats", "/cache/stats", "/batching/stats",
+               "/cascade/stats"}
+# Job status and results are read from the job database, never from a model
+LIGHT_PREFIXES = ("/jobs/",)
+
+rejected_requests = metrics.counter("asgi_rejected_total", "Requests rejected with 429 because the queue was full",
+                                    ["route"])
+
+
+def wsgi_environ(scope, body, content_length):
+    """WSGI environ for an ASGI HTTP scope whose body has been read into `body`"""
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf8").decode("latin1"),
+        "PATH_INFO": path.encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(content_length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin1")
+        value = value.decode("latin1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AdmissionControlledApp:
+    """
+    ASGI app running a WSGI app on thread pools, with a bounded number of admitted requests.
+    Each request's WSGI call and response iteration run on one pool thread (Flask keeps the
+    request context in that thread), and chunks are handed to the event loop as they are produced.
+    """
+
+    def __init__(self, wsgi_app, workers, queue_size, light_paths=(), light_prefixes=(), light_workers=2):
+        self.wsgi_app = wsgi_app
+        self.capacity = workers + queue_size
+        self.light_paths = set(light_paths)
+        self.light_prefixes = tuple(light_prefixes)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.light_pool = ThreadPoolExecutor(max_workers=light_workers, thread_name_prefix="light")
+        self.admitted = 0  # running or waiting for a pool thread (only changed on the event loop)
+        self.running = 0
+        self._running_lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if scope["path"] in self.light_paths or scope["path"].startswith(self.light_prefixes):
+            await self._handle(scope, receive, send, self.light_pool)
+            return
+        if self.admitted >= self.capacity:
+            rejected_requests.inc(scope["path"])
+            await self._reject(send)
+            return
+        self.admitted += 1
+        try:
+            await self._handle(scope, receive, send, self.pool)
+        finally:
+            self.admitted -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                start_worker_threads()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                self.light_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _reject(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"retry-after", str(ASGI_RETRY_AFTER).encode()),
+                        (b"access-control-allow-origin", b"*")],
+        })
+        await send({"type": "http.response.body", "body": b'{"error": "Server is busy, please retry shortly"}'})
+
+    async def _handle(self, scope, receive, send, pool):
+        body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES)
+        try:
+            size = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunk = message.get("body", b"")
+                body.write(chunk)
+                size += len(chunk)
+                more_body = message.get("more_body", False)
+            body.seek(0)
+            environ = wsgi_environ(scope, body, size)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(pool, self._run_wsgi, environ, send, loop, pool is self.pool)
+        finally:
+            body.close()
+
+    def _run_wsgi(self, environ, send, loop, heavy):
+        def send_sync(message):
+            # Waits until the event loop has sent the message - backpressure for streamed bodies
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+            return lambda data: None
+
+        if heavy:
+            with self._running_lock:
+                self.running += 1
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                send_sync({"type": "http.response.start", "status": response["status"],
+                           "headers": response["headers"]})
+                for chunk in iterable:
+                    if chunk:
+                        send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+                send_sync({"type": "http.response.body", "body": b"", "more_body": False})
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+        finally:
+            if heavy:
+                with self._running_lock:
+                    self.running -= 1
+
+
+app = AdmissionControlledApp(flask_app, workers=ASGI_INFERENCE_WORKERS, queue_size=ASGI_QUEUE_SIZE,
+                             light_paths=LIGHT_PATHS, light_prefixes=LIGHT_PREFIXES)
+
+metrics.gauge("asgi_running_requests", "Requests running on the inference pool", lambda: app.running)
+metrics.gauge("asgi_queued_requests", "Admitted requests waiting for an inference thread",
+              lambda: max(0, app.admitted - app.running))
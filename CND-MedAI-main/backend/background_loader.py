@@ -0,0 +1,150 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LazyModel:
+    """
+    Handle to a model that may still be loading. Calling it waits for the load to finish and
+    then runs the model, so it can be used anywhere the model itself was used.
+    """
+
+    def __init__(self, name, load, keep=True):
+        self.name = name
+        self.load = load
+        self.keep = keep
+        self.state = "loading"
+        self.model = None
+        self.error = None
+        self.load_seconds = None
+        self._done = threading.Event()
+
+    def _finish(self, model, error, elapsed):
+        self.model = model if self.keep else None
+        self.error = error
+        self.state = "ready" if model is not None else "failed"
+        self.load_seconds = round(elapsed, 3)
+        self._done.set()
+
+    def _restart(self):
+        self.state = "loading"
+        self._done.clear()
+
+    def ready(self):
+        return self.state == "ready"
+
+    def get(self, timeout=None):
+        """The loaded model, waiting for it if needed. Raises if the load failed or timed out."""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} model is still loading")
+        if self.model is None:
+            raise RuntimeError(f"{self.name} model failed to load" + (f": {self.error}" if self.error else ""))
+        return self.model
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+class BackgroundLoader:
+    """
+    Loads models on a pool of background threads so the server can bind its port and answer
+    health checks while the weights are still being read. `prepare` runs once before the
+    first load (e.g. to import heavy libraries on one thread rather than several at once).
+    With background=False every load runs inline at submit() time, as a plain import did.
+    """
+
+    def __init__(self, background=True, workers=4, prepare=None, started=None):
+        self.background = background
+        self.prepare = prepare
+        self.models = {}
+        self.started = started if started is not None else time.perf_counter()
+        self.ready_seconds = None
+        self._lock = threading.Lock()
+        self._prepare_lock = threading.Lock()
+        self._prepared = False
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-load") if background else None
+
+    def submit(self, name, load, keep=True):
+        """
+        Start loading model `name` with `load()` (None means the load failed) and return its
+        LazyModel handle. With keep=False only readiness is tracked and the result is dropped
+        (for models another cache holds on to).
+        """
+        handle = LazyModel(name, load, keep=keep)
+        with self._lock:
+            self.models[name] = handle
+        if self._pool is None:
+            self._load(handle, load)
+        else:
+            self._pool.submit(self._load, handle, load)
+        return handle
+
+    def _load(self, handle, load):
+        start = time.perf_counter()
+        model, error = None, None
+        try:
+            with self._prepare_lock:
+                if not self._prepared and self.prepare is not None:
+                    self.prepare()
+                self._prepared = True
+            model = load()
+        except Exception as e:
+            error = str(e)
+            print(f"Failed to load {handle.name}: {e}")
+        handle._finish(model, error, time.perf_counter() - start)
+        self._check_done()
+
+    def reload(self):
+        """
+        Load every kept model again (e.g. after its weights changed), each on its own thread even
+        with background=False, so the caller (a request that noticed the change) isn't the one
+        loading them. Requests wait for the new model as they do at startup. Models still
+        loading, and keep=False models (held by another cache), are left alone.
+        """
+        with self._lock:
+            handles = [handle for handle in self.models.values() if handle.keep and handle._done.is_set()]
+        for handle in handles:
+            print(f"Reloading {handle.name}")
+            handle._restart()
+            threading.Thread(target=self._load, args=(handle, handle.load),
+                             name=f"model-reload-{handle.name}", daemon=True).start()
+
+    def _check_done(self):
+        with self._lock:
+            if not self._closed or self.ready_seconds is not None:
+                return
+            if all(handle._done.is_set() for handle in self.models.values()):
+                self.ready_seconds = round(time.perf_counter() - self.started, 3)
+                print(f"All models loaded {self.ready_seconds}s after startup")
+
+    def close(self):
+        """No more models will be submitted - let the loader threads exit once their work is done"""
+        with self._lock:
+            self._closed = True
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._check_done()
+
+    def wait(self, timeout=None):
+        """Block until every submitted model has finished loading (or failed). Returns True when all are done."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for handle in list(self.models.values()):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not handle._done.wait(remaining):
+                return False
+        return True
+
+    def status(self):
+        with self._lock:
+            handles = dict(self.models)
+            ready_seconds = self.ready_seconds
+        return {
+            "ready": all(handle.ready() for handle in handles.values()),
+            "models": {
+                name: {"state": handle.state, "load_seconds": handle.load_seconds,
+                       **({"error": handle.error} if handle.error else {})}
+                for name, handle in handles.items()
+            },
+            "models_loaded_seconds": ready_seconds,
+        }
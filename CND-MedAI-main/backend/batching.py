@@ -0,0 +1,127 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import torch
+
+# Upper bounds of the queue depth histogram buckets
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64]
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for one model and runs them as a single batched forward pass.
+    A batch is dispatched as soon as it holds `max_batch_size` samples or the oldest request
+    has waited `max_wait_ms`, whichever comes first. Each caller gets back its own slice
+    of the output (with the batch dimension kept), so code written for `.unsqueeze(0)`
+    tensors works unchanged.
+    """
+
+    def __init__(self, model_fn, max_batch_size=8, max_wait_ms=5.0, name="model"):
+        self.model_fn = model_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+        self.requests = 0
+        self.samples = 0
+        self.batches = 0
+        self.wait_time_total = 0.0
+
+    def _ensure_worker(self):
+        # Started lazily, and restarted in forked worker processes (threads don't survive fork)
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+            self._worker.start()
+
+    def submit(self, tensor):
+        """Run `tensor` (shape (n, ...)) through the model as part of a batch and return its output rows."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((tensor, future, time.perf_counter()))
+        return future.result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        size = items[0][0].shape[0]
+        deadline = items[0][2] + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            size += item[0].shape[0]
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            depth = self._queue.qsize()
+            # Requests with a different sample shape can't be concatenated - run them in their own group
+            groups = {}
+            for item in items:
+                groups.setdefault(tuple(item[0].shape[1:]), []).append(item)
+            for group in groups.values():
+                self._run_batch(group)
+            self._record(items, depth)
+
+    def _run_batch(self, items):
+        try:
+            batch = torch.cat([tensor for tensor, _, _ in items], dim=0)
+            with torch.no_grad():
+                outputs = self.model_fn(batch)
+        except Exception as e:
+            for _, future, _ in items:
+                future.set_exception(e)
+            return
+        offset = 0
+        for tensor, future, _ in items:
+            n = tensor.shape[0]
+            future.set_result(outputs[offset:offset + n])
+            offset += n
+
+    def _record(self, items, depth):
+        now = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.requests += len(items)
+            samples = sum(item[0].shape[0] for item in items)
+            self.samples += samples
+            self.batch_sizes[samples] += 1
+            bucket = next((b for b in QUEUE_DEPTH_BUCKETS if depth <= b), "+Inf")
+            self.queue_depths[bucket] += 1
+            self.wait_time_total += sum(now - item[2] for item in items)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "requests": self.requests,
+                "samples": self.samples,
+                "batches": self.batches,
+                "queue_depth": self._queue.qsize(),
+                "avg_batch_size": round(self.samples / self.batches, 3) if self.batches else None,
+                "avg_latency_ms": round(self.wait_time_total / self.requests * 1000, 3) if self.requests else None,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                "queue_depth_histogram": {
+                    str(b): self.queue_depths.get(b, 0) for b in QUEUE_DEPTH_BUCKETS + ["+Inf"]
+                },
+            }
@@ -0,0 +1,431 @@
+"""
+Benchmark the inference service and write the results as JSON, so runs can be compared across commits.
+
+    python benchmark.py                                        # everything, written to benchmark.json
+    python benchmark.py --only models --models stage1 stage2
+    python benchmark.py --compare baseline.json                # exit 1 if anything regressed
+
+Models are loaded the way app.py serves them (model_loading.py: weight store, checkpoint loading,
+INFERENCE_BACKEND / QUANTIZED_MODELS / CPU_PROFILE_MODELS). A model whose checkpoint is missing
+gets random weights instead - latency and memory don't depend on the weight values. Every section runs in a fresh process, so the peak RSS it reports is its own.
+
+Sections:
+  models      load time, single-input latency, batched throughput and peak RSS per model
+  preprocess  decode plus the model input tensors for a synthetic JPEG scan
+  epilepsy    the /epilepsy CSV path (parse + model) on rows shaped like balanced_test_data.csv
+  eeg_signal  the /epilepsy/signal path (sliding windows + model) on a raw float32 recording of the same length
+  http        the Flask app driven in-process by a concurrent load generator (/pipeline, /epilepsy)
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from architectures import build_model, example_input
+from metrics import resident_memory_bytes, peak_resident_memory_bytes
+from model_loading import CHECKPOINTS, MODEL_NAMES, load_served_model, with_backend
+
+REFERENCE_CSV = "./balanced_test_data.csv"
+SECTIONS = ["models", "preprocess", "epilepsy", "eeg_signal", "http"]
+# Environment variables that change what is being measured - recorded with the results
+RECORDED_ENV = ["INFERENCE_BACKEND", "QUANTIZED_MODELS", "MICRO_BATCHING", "BATCH_MAX_SIZE", "BATCH_MAX_WAIT_MS",
+                "CPU_PROFILE_MODELS", "CPU_PROFILE_COMPILE", "WEIGHT_STORE_DIR",
+                "JPEG_DRAFT_DECODE", "EEG_CHUNK_ROWS", "EEG_BATCH_SIZE", "EEG_SIGNAL_HOP", "EEG_SIGNAL_BATCH_SIZE",
+                "BACKGROUND_MODEL_LOADING"]
+
+
+def mb(value):
+    return round(value / (1024 * 1024), 1) if value is not None else None
+
+
+def latency_stats(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def set_threads(threads):
+    if threads:
+        torch.set_num_threads(threads)
+
+
+def synthetic_jpeg(rng, size):
+    """JPEG with smooth random content (pure noise would compress unlike a real scan)"""
+    from PIL import Image
+    coarse = rng.integers(0, 255, (size // 16 + 1, size // 16 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((size, size), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def eeg_columns():
+    if os.path.exists(REFERENCE_CSV):
+        with open(REFERENCE_CSV) as f:
+            return f.readline().strip().split(",")
+    return [f"X{i}" for i in range(1, 179)] + ["y"]
+
+
+def synthetic_eeg_csv(rows, rng):
+    """CSV bytes with `rows` EEG segments in the balanced_test_data.csv layout"""
+    columns = eeg_columns()
+    values = rng.normal(0, 100, (rows, len(columns))).astype(np.int32)
+    if "y" in columns:
+        values[:, columns.index("y")] = rng.integers(0, 2, rows)
+    buffer = io.StringIO()
+    buffer.write(",".join(columns) + "\n")
+    np.savetxt(buffer, values, fmt="%d", delimiter=",")
+    return buffer.getvalue().encode()
+
+
+def load_model(name):
+    """
+    The model loaded and wrapped exactly as app.py serves it (model_loading.load_served_model), or
+    through the same backend with random weights when its checkpoint is missing
+    """
+    device = torch.device("cpu")
+    if os.path.exists(CHECKPOINTS[name]):
+        return load_served_model(name, device), "checkpoint"
+    return with_backend(name, device, lambda: build_model(name).eval()), "random"
+
+
+# ---- Sections (each run in its own process) ----
+def bench_model(name, args):
+    set_threads(args.threads)
+    rss_start = resident_memory_bytes()
+    start = time.perf_counter()
+    model, weights = load_model(name)
+    result = {"weights": weights, "load_seconds": round(time.perf_counter() - start, 3),
+              "model_rss_mb": mb(resident_memory_bytes() - rss_start) if rss_start else None}
+    example = example_input(name, 1)
+    with torch.no_grad():
+        for _ in range(args.warmup):
+            model(example)
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            model(example)
+            times.append(time.perf_counter() - start)
+        result["latency"] = latency_stats(times)
+        result["throughput"] = {}
+        for batch_size in args.batch_sizes:
+            batch = example_input(name, batch_size)
+            model(batch)
+            iterations = max(3, args.repeats // batch_size)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                model(batch)
+            elapsed = time.perf_counter() - start
+            result["throughput"][f"batch_{batch_size}"] = {
+                "samples_per_second": round(batch_size * iterations / elapsed, 2),
+                "batch_ms": round(elapsed / iterations * 1000, 3),
+            }
+    result["peak_rss_mb"] = mb(peak_resident_memory_bytes())
+    return result
+
+
+def bench_preprocess(args):
+    from preprocessing import PreparedImage, batch_tensor, decode_image, NORMAL, HALF, SUBTYPE
+    set_threads(args.threads)
+    rng = np.random.default_rng(0)
+    images = [synthetic_jpeg(rng, args.image_size) for _ in range(8)]
+    draft = os.environ.get("JPEG_DRAFT_DECODE", "0") == "1"
+    times = []
+    for i in range(args.repeats):
+        start = time.perf_counter()
+        prepared = PreparedImage(decode_image(io.BytesIO(images[i % len(images)]), draft=draft))
+        for variant in (NORMAL, SUBTYPE, HALF):
+            prepared.tensor(variant)
+        times.append(time.perf_counter() - start)
+    # How far the draft decode moves the model inputs away from the full decode
+    draft_difference = max(
+        float((PreparedImage(decode_image(io.BytesIO(data), draft=True)).tensor(variant)
+               - PreparedImage(decode_image(io.BytesIO(data))).tensor(variant)).abs().max())
+        for data in images for variant in (NORMAL, SUBTYPE, HALF))
+    prepared = [PreparedImage(decode_image(io.BytesIO(data), draft=draft)) for data in images * 4]
+    start = time.perf_counter()
+    batch_tensor(prepared, NORMAL)
+    elapsed = time.perf_counter() - start
+    return {
+        "image_size": args.image_size,
+        "jpeg_kb": round(np.mean([len(data) for data in images]) / 1024, 1),
+        "decode_and_tensors": latency_stats(times),
+        "batch_tensor_images_per_second": round(len(prepared) / elapsed, 2),
+        "jpeg_draft_decode": draft,
+        "draft_max_input_difference": round(draft_difference, 4),
+        "peak_rss_mb": mb(peak_resident_memory_bytes()),
+    }
+
+
+def bench_epilepsy(args):
+    import eeg
+    set_threads(args.threads)
+    model, weights = load_model("epilepsy")
+    data = synthetic_eeg_csv(args.eeg_rows, np.random.default_rng(0))
+    schema = eeg.CsvSchema(eeg_columns())
+    chunk_rows = int(os.environ.get("EEG_CHUNK_ROWS", 2048))
+    batch_size = int(os.environ.get("EEG_BATCH_SIZE", 256))
+    # Warm-up on a small slice
+    for _ in eeg.iter_csv_predictions(io.BytesIO(data[:20000].rsplit(b"\n", 1)[0]), model, torch.device("cpu"),
+                                      schema, chunk_rows, batch_size):
+        pass
+    start = time.perf_counter()
+    rows = 0
+    for _, probs in eeg.iter_csv_predictions(io.BytesIO(data), model, torch.device("cpu"), schema,
+                                             chunk_rows, batch_size):
+        rows += len(probs)
+    elapsed = time.perf_counter() - start
+    return {
+        "weights": weights,
+        "rows": rows,
+        "csv_mb": mb(len(data)),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1),
+        "peak_rss_mb": mb(peak_resident_memory_bytes()),
+    }
+
+
+def eeg_csv_signal_difference(model, rows=500):
+    """
+    Largest difference between the probabilities /epilepsy gives CSV rows and the ones
+    /epilepsy/signal gives the same rows laid end to end as one signal (hop 178)
+    """
+    import eeg
+    import pandas as pd
+    data = synthetic_eeg_csv(rows, np.random.default_rng(1))
+    schema = eeg.CsvSchema(eeg_columns())
+    from_csv = np.concatenate([probs for _, probs in
+                               eeg.iter_csv_predictions(io.BytesIO(data), model, torch.device("cpu"), schema)])
+    samples = [f"X{i}" for i in range(1, eeg.WINDOW_SAMPLES + 1)]
+    signal = pd.read_csv(io.BytesIO(data))[samples].to_numpy(np.float32).reshape(-1)
+    from_signal = np.concatenate([probs for _, probs in eeg.iter_signal_predictions(
+        iter([signal]), model, torch.device("cpu"), hop=eeg.WINDOW_SAMPLES)])
+    return float(np.abs(from_csv - from_signal).max())
+
+
+def bench_eeg_signal(args):
+    import eeg
+    set_threads(args.threads)
+    model, weights = load_model("epilepsy")
+    # The same segment must get the same probability from both EEG paths
+    difference = eeg_csv_signal_difference(model)
+    if difference > 1e-5:
+        print(f"WARNING: /epilepsy and /epilepsy/signal disagree on the same segments by up to {difference:.2e}")
+    rng = np.random.default_rng(0)
+    data = (rng.standard_normal(args.eeg_rows * eeg.WINDOW_SAMPLES) * 100).astype("<f4").tobytes()
+    hop = int(os.environ.get("EEG_SIGNAL_HOP", eeg.WINDOW_SAMPLES // 2))
+    batch_size = int(os.environ.get("EEG_SIGNAL_BATCH_SIZE", os.environ.get("EEG_BATCH_SIZE", 256)))
+
+    def run(signal):
+        chunks = eeg.iter_signal_chunks(io.BytesIO(signal), "float32")
+        return sum(len(probs) for _, probs in
+                   eeg.iter_signal_predictions(chunks, model, torch.device("cpu"), hop, batch_size))
+    run(data[:4 * 20000])  # warm-up
+    start = time.perf_counter()
+    windows = run(data)
+    elapsed = time.perf_counter() - start
+    return {
+        "weights": weights,
+        "samples": len(data) // 4,
+        "hop": hop,
+        "windows": windows,
+        "signal_mb": mb(len(data)),
+        "seconds": round(elapsed, 3),
+        "windows_per_second": round(windows / elapsed, 1),
+        "samples_per_second": round(len(data) / 4 / elapsed, 1),
+        "csv_signal_max_difference": difference,
+        "peak_rss_mb": mb(peak_resident_memory_bytes()),
+    }
+
+
+def prepare_workdir(directory):
+    """
+    Working directory the app can be imported from. Checkpoints that are missing are written
+    with random weights (and the reference CSV generated) in `directory`; existing ones are linked.
+    """
+    if all(os.path.exists(path) for path in CHECKPOINTS.values()) and os.path.exists(REFERENCE_CSV):
+        return os.getcwd()
+    for name, path in CHECKPOINTS.items():
+        target = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(path):
+            os.symlink(os.path.abspath(path), target)
+        else:
+            torch.save(build_model(name).state_dict(), target)
+    if os.path.exists(REFERENCE_CSV):
+        os.symlink(os.path.abspath(REFERENCE_CSV), os.path.join(directory, "balanced_test_data.csv"))
+    else:
+        with open(os.path.join(directory, "balanced_test_data.csv"), "wb") as f:
+            f.write(synthetic_eeg_csv(10, np.random.default_rng(0)))
+    return directory
+
+
+def bench_http(args):
+    set_threads(args.threads)
+    os.environ.setdefault("RESULT_CACHE", "0")  # every request should run the models
+    os.environ.setdefault("FLASK_DEBUG", "0")
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        sys.path.insert(0, os.getcwd())
+        os.chdir(prepare_workdir(directory))
+        start = time.perf_counter()
+        import app
+        import_seconds = time.perf_counter() - start
+        app.model_loader.wait()
+        images = [synthetic_jpeg(rng, args.image_size) for _ in range(args.http_requests)]
+        csv_data = synthetic_eeg_csv(500, rng)
+
+        def pipeline_request(i):
+            client = app.app.test_client()
+            return client.post("/pipeline", data={"file": (io.BytesIO(images[i]), f"scan{i}.jpg")})
+
+        def epilepsy_request(i):
+            client = app.app.test_client()
+            return client.post("/epilepsy", data={"file": (io.BytesIO(csv_data), "eeg.csv")})
+
+        result = {"import_seconds": round(import_seconds, 3), "concurrency": args.concurrency}
+        for route, send, count in [("/pipeline", pipeline_request, args.http_requests),
+                                   ("/epilepsy", epilepsy_request, max(1, args.http_requests // 4))]:
+            send(0)  # warm-up (and loads the final model on first use)
+
+            def timed(i):
+                started = time.perf_counter()
+                response = send(i)
+                return time.perf_counter() - started, response.status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                outcomes = list(pool.map(timed, range(count)))
+            elapsed = time.perf_counter() - start
+            result[route] = {
+                "requests": count,
+                "errors": sum(1 for _, status in outcomes if status != 200),
+                "requests_per_second": round(count / elapsed, 2),
+                "latency": latency_stats([seconds for seconds, _ in outcomes]),
+            }
+        result["peak_rss_mb"] = mb(peak_resident_memory_bytes())
+    return result
+
+
+def run_isolated(fn, *args):
+    """Run fn(*args) in a fresh process and return its result"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+# ---- Comparison ----
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    """Print metrics that changed by more than `tolerance` and return the ones that got worse"""
+    current, baseline = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    for path, value in sorted(current.items()):
+        old = baseline.get(path)
+        higher_is_better = path.endswith("per_second")
+        lower_is_better = path.endswith(("p50_ms", "p90_ms", "mean_ms", "batch_ms", "rss_mb", "seconds"))
+        if old in (None, 0) or not (higher_is_better or lower_is_better):
+            continue
+        change = (value - old) / old
+        if abs(change) <= tolerance:
+            continue
+        worse = change < 0 if higher_is_better else change > 0
+        print(f"{'REGRESSION' if worse else 'improved  '} {path}: {old} -> {value} ({change:+.1%})")
+        if worse:
+            regressions.append(path)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, default=SECTIONS)
+    parser.add_argument("--models", nargs="+", choices=MODEL_NAMES, default=MODEL_NAMES)
+    parser.add_argument("--repeats", type=int, default=30, help="timed runs per latency measurement")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--threads", type=int, help="torch intra-op threads (default: torch's default)")
+    parser.add_argument("--image-size", type=int, default=512, help="side of the synthetic scans")
+    parser.add_argument("--eeg-rows", type=int, default=20000)
+    parser.add_argument("--http-requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change reported by --compare")
+    args = parser.parse_args()
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        "meta": {
+            "commit": commit or None,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": args.threads or torch.get_num_threads(),
+            "env": {name: os.environ[name] for name in RECORDED_ENV if name in os.environ},
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    results = report["results"]
+    if "models" in args.only:
+        results["models"] = {}
+        for name in args.models:
+            print(f"[models] {name}")
+            results["models"][name] = run_isolated(bench_model, name, args)
+    if "preprocess" in args.only:
+        print("[preprocess]")
+        results["preprocess"] = run_isolated(bench_preprocess, args)
+    if "epilepsy" in args.only:
+        print("[epilepsy]")
+        results["epilepsy"] = run_isolated(bench_epilepsy, args)
+    if "eeg_signal" in args.only:
+        print("[eeg_signal]")
+        results["eeg_signal"] = run_isolated(bench_eeg_signal, args)
+    if "http" in args.only:
+        print("[http]")
+        results["http"] = run_isolated(bench_http, args)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Wrote {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
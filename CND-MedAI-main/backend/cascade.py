@@ -0,0 +1,68 @@
+import threading
+
+import torch
+
+# Ways a scan can leave the image cascade
+NOT_OUR_MODALITY = "not_our_modality"  # stopped after stage 1
+CONFIDENT_SUBTYPE = "confident_subtype"  # stage 3 implied the group, stage 2 skipped
+FULL = "full"  # every stage ran
+EXITS = (NOT_OUR_MODALITY, CONFIDENT_SUBTYPE, FULL)
+
+
+def subtype_group(subtype):
+    """Stage 2 class implied by a stage 3 subtype"""
+    return "Cancer" if subtype.startswith("cancer_") else "Neurological Disorder"
+
+
+def group_confidences(probabilities, class_names):
+    """
+    For each row of stage 3 softmax probabilities, the top subtype and the total probability of
+    the subtypes in its group (cancer or neurological) - how sure stage 3 is of the stage 2 answer.
+    """
+    groups = [subtype_group(name) for name in class_names]
+    cancer = torch.tensor([group == "Cancer" for group in groups], device=probabilities.device)
+    cancer_probability = probabilities[:, cancer].sum(dim=1)
+    results = []
+    for idx, p_cancer in zip(torch.argmax(probabilities, dim=1).tolist(), cancer_probability.tolist()):
+        confidence = p_cancer if groups[idx] == "Cancer" else 1.0 - p_cancer
+        results.append((class_names[idx], round(confidence, 4)))
+    return results
+
+
+class CascadeStats:
+    """
+    How often each exit of the cascade is taken. When stage 2 does run on a scan stage 3 was
+    confident about (early exit turned off, or a shadow check), it also counts whether stage 2
+    agreed with the group stage 3 implied - the evidence for choosing the threshold.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.exits = dict.fromkeys(EXITS, 0)
+        self.confident_checked = 0
+        self.confident_agreed = 0
+        self._lock = threading.Lock()
+
+    def record(self, exit, count=1):
+        with self._lock:
+            self.exits[exit] += count
+
+    def record_agreement(self, subtype, confidence, classification):
+        if confidence < self.threshold:
+            return
+        with self._lock:
+            self.confident_checked += 1
+            self.confident_agreed += int(subtype_group(subtype) == classification)
+
+    def stats(self):
+        with self._lock:
+            scans = sum(self.exits.values())
+            return {
+                "group_confidence_threshold": self.threshold,
+                "scans": scans,
+                "exits": dict(self.exits),
+                "exit_rates": {name: round(count / scans, 4) if scans else None for name, count in self.exits.items()},
+                "confident_checked": self.confident_checked,
+                "confident_agreement_rate": round(self.confident_agreed / self.confident_checked, 4)
+                if self.confident_checked else None,
+            }
@@ -0,0 +1,97 @@
+"""
+Convert the .pth checkpoints in AI-Models/ to a memory-mapped weight store (safetensors), which
+app.py then loads without unpickling. Tensors that are identical across checkpoints are stored once.
+
+    pip install safetensors
+    python convert_weights.py                          # every .pth in AI-Models/
+    python convert_weights.py --checkpoints Breast Lung
+
+Converting only some checkpoints keeps the others already in the store. Each converted checkpoint is
+read back from the store and compared with the .pth tensor by tensor. Values other than tensors
+(e.g. a saved epoch number) are not kept. app.py falls back to the .pth for any checkpoint that
+changed after it was converted.
+"""
+import argparse
+import glob
+import os
+import time
+
+import torch
+
+from weight_store import WeightStore, checkpoint_name, source_signature, unwrap_checkpoint, write_store
+
+MODELS_DIR = "./AI-Models"
+WEIGHT_STORE_DIR = os.environ.get("WEIGHT_STORE_DIR", os.path.join(MODELS_DIR, "weights"))
+
+
+def read_checkpoint(path):
+    """(wrapper, tensors, skipped keys) of a .pth"""
+    checkpoint = torch.load(path, map_location="cpu")
+    if isinstance(checkpoint, torch.nn.Module):
+        checkpoint = checkpoint.state_dict()
+    wrapper, state_dict = unwrap_checkpoint(checkpoint)
+    tensors = {key: value for key, value in state_dict.items() if isinstance(value, torch.Tensor)}
+    skipped = sorted(str(key) for key in state_dict if key not in tensors)
+    return wrapper, tensors, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoints", nargs="+", help="checkpoint names without .pth (default: every .pth)")
+    parser.add_argument("--models-dir", default=MODELS_DIR, help="directory of the .pth files (default: %(default)s)")
+    parser.add_argument("--out", default=WEIGHT_STORE_DIR, help="weight store directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    paths = {checkpoint_name(path): path for path in sorted(glob.glob(os.path.join(args.models_dir, "*.pth")))}
+    names = args.checkpoints or list(paths)
+    missing = [name for name in names if name not in paths]
+    if missing:
+        parser.error(f"no .pth for {', '.join(missing)} in {args.models_dir}")
+
+    checkpoints = {}
+    # Keep the checkpoints already in the store that aren't being converted now
+    existing = WeightStore(args.out)
+    if existing.manifest is not None:
+        for name, entry in existing.manifest["models"].items():
+            if name not in names:
+                wrapper = entry.get("wrapper")
+                state_dict = existing.load(name)
+                state_dict = state_dict[wrapper] if wrapper else state_dict
+                signature = {field: entry[field] for field in ("source_size", "source_mtime_ns") if field in entry}
+                checkpoints[name] = (wrapper, state_dict, signature)
+
+    pth_bytes = 0
+    for name in names:
+        wrapper, tensors, skipped = read_checkpoint(paths[name])
+        if skipped:
+            print(f"[{name}] not stored (not tensors): {', '.join(skipped)}")
+        checkpoints[name] = (wrapper, tensors, source_signature(paths[name]))
+        pth_bytes += os.path.getsize(paths[name])
+
+    write_store(args.out, checkpoints, metadata={"torch": torch.__version__})
+
+    store = WeightStore(args.out)
+    total_tensors = sum(len(state_dict) for _, state_dict, _ in checkpoints.values())
+    total_bytes = sum(t.numel() * t.element_size() for _, state_dict, _ in checkpoints.values()
+                      for t in state_dict.values())
+    unique = store.tensors()
+    unique_bytes = sum(t.numel() * t.element_size() for t in unique.values())
+    for name in names:
+        start = time.perf_counter()
+        loaded = store.load(name)
+        elapsed = time.perf_counter() - start
+        wrapper, expected, _ = read_checkpoint(paths[name])
+        loaded = loaded[wrapper] if wrapper else loaded
+        mismatched = [key for key in expected if not torch.equal(expected[key], loaded[key])]
+        status = f"{len(mismatched)} tensors differ" if mismatched else "identical"
+        print(f"[{name}] {len(expected)} tensors, {status}, loaded in {elapsed * 1000:.1f} ms")
+
+    store_size = os.path.getsize(store.path)
+    print(f"{len(checkpoints)} checkpoints, {total_tensors} tensors ({total_bytes / 1e6:.1f} MB), "
+          f"{len(unique)} distinct ({unique_bytes / 1e6:.1f} MB) in {store.path} ({store_size / 1e6:.1f} MB)")
+    if pth_bytes:
+        print(f".pth files converted this run: {pth_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import csv
+
+import numpy as np
+import torch
+
+# A segment is reported as a seizure when the model's probability reaches this value
+SEIZURE_THRESHOLD = 0.0001
+EXCLUDE_COLS = ['y', 'original_row']
+# Samples per segment the model was trained on (one second of the recordings at 178 Hz)
+WINDOW_SAMPLES = 178
+SIGNAL_FORMATS = ("csv", "float32")
+
+
+def label(prob):
+    return "Seizure" if prob >= SEIZURE_THRESHOLD else "Non-seizure"
+
+
+def served_features(columns):
+    """
+    Feature columns in the order the model has always been fed: sorted by name, as pandas
+    Index.difference returned them (X1, X10, X100, X101, ...), not in time order
+    """
+    return sorted(col for col in columns if col not in EXCLUDE_COLS)
+
+
+# Position in a window of each sample the model is fed, in that order: /epilepsy/signal permutes
+# its windows with this so a segment gets the same probability it gets as a CSV row
+SERVED_SAMPLE_ORDER = np.array([int(col[1:]) - 1 for col in
+                                served_features(f"X{i}" for i in range(1, WINDOW_SAMPLES + 1))])
+
+
+class CsvSchema:
+    """
+    The expected header of an EEG CSV (the reference file's), built once at startup so checking
+    an upload is one length check and one frozenset comparison of its header line.
+    """
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.column_set = frozenset(self.columns)
+        self.feature_columns = tuple(served_features(self.columns))
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="") as f:
+            return cls(next(csv.reader(f)))
+
+    def matches(self, header):
+        return len(header) == len(self.columns) and frozenset(header) == self.column_set
+
+
+def read_header(source):
+    """Column names from the first line of a binary CSV stream, leaving the stream where it was"""
+    position = source.tell()
+    line = source.readline()
+    source.seek(position)
+    return next(csv.reader([line.decode("utf-8-sig")]), [])
+
+
+def feature_columns(source, schema=None, sniff_rows=100):
+    """
+    Columns fed to EpilepsyModel: every numeric column except the label/row id columns.
+    Files whose header matches `schema` (a CsvSchema) use its columns without reading any rows;
+    other files have their column types sniffed from the first rows.
+    """
+    if schema is not None and schema.matches(read_header(source)):
+        return list(schema.feature_columns)
+    import pandas as pd
+    sample = pd.read_csv(source, nrows=sniff_rows)
+    source.seek(0)
+    return served_features(sample.select_dtypes(include='number').columns)
+
+
+def iter_feature_chunks(source, columns, chunk_rows):
+    """
+    Yield float32 arrays of shape (chunk_rows, len(columns)) (the last one may be shorter).
+    The CSV is parsed by pyarrow straight to float32 in the model's column order, one block at
+    a time, falling back to pandas when pyarrow isn't installed.
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        yield from _iter_feature_chunks_pandas(source, columns, chunk_rows)
+        return
+    # include_columns also sets the order of the parsed columns
+    options = pa_csv.ConvertOptions(include_columns=columns, column_types={col: pa.float32() for col in columns})
+    pending, pending_rows = [], 0
+    for batch in pa_csv.open_csv(source, convert_options=options):
+        if batch.num_rows == 0:
+            continue
+        features = np.empty((batch.num_rows, len(columns)), dtype=np.float32)
+        for i, column in enumerate(batch.columns):
+            features[:, i] = column.to_numpy(zero_copy_only=False)
+        pending.append(features)
+        pending_rows += batch.num_rows
+        # Blocks are sized in bytes - regroup them into chunks of exactly chunk_rows rows
+        while pending_rows >= chunk_rows:
+            features = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield features[:chunk_rows]
+            rest = features[chunk_rows:]
+            pending, pending_rows = ([rest], len(rest)) if len(rest) else ([], 0)
+    if pending_rows:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+def _iter_feature_chunks_pandas(source, columns, chunk_rows):
+    import pandas as pd
+    reader = pd.read_csv(source, usecols=columns, dtype={col: np.float32 for col in columns},
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        # usecols keeps file order - reorder to the model's column order
+        yield np.ascontiguousarray(chunk[columns].to_numpy(dtype=np.float32))
+
+
+def predict_probabilities(model, features, device, batch_size):
+    """Seizure probability for each row of `features`, run through the model batch_size rows at a time"""
+    probs = []
+    with torch.no_grad():
+        for start in range(0, len(features), batch_size):
+            batch = torch.from_numpy(features[start:start + batch_size]).unsqueeze(2).to(device)
+            probs.append(model(batch).reshape(-1).cpu().numpy())
+    if not probs:
+        return np.empty(0, dtype=np.float32)
+    return np.concatenate(probs)
+
+
+def iter_csv_predictions(source, model, device, schema=None, chunk_rows=2048, batch_size=256):
+    """Yield (first_row_index, probabilities) for each chunk of the CSV. Memory is bounded by chunk_rows."""
+    columns = feature_columns(source, schema)
+    offset = 0
+    for features in iter_feature_chunks(source, columns, chunk_rows):
+        yield offset, predict_probabilities(model, features, device, batch_size)
+        offset += len(features)
+
+
+# ---- Continuous recordings ----
+def iter_signal_chunks(source, signal_format, column=None, chunk_samples=1 << 16):
+    """
+    Yield the samples of a continuous single-channel recording as 1-D float32 arrays. `source` is
+    a binary stream of either a CSV (one sample per row in `column`, by default the first column)
+    or raw little-endian float32 values.
+    """
+    if signal_format == "float32":
+        carry = b""
+        while True:
+            data = source.read(chunk_samples * 4)
+            if not data:
+                break
+            if carry:
+                data = carry + data
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            yield np.frombuffer(data, dtype="<f4", count=usable // 4)
+        if carry:
+            raise ValueError("float32 signal length is not a multiple of 4 bytes")
+        return
+    if signal_format != "csv":
+        raise ValueError(f"Signal format must be one of: {', '.join(SIGNAL_FORMATS)}")
+    header = read_header(source)
+    column = column or (header[0] if header else None)
+    if column not in header:
+        raise ValueError(f"Column {column!r} not found in the CSV")
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        import pandas as pd
+        for chunk in pd.read_csv(source, usecols=[column], dtype={column: np.float32}, chunksize=chunk_samples):
+            yield chunk[column].to_numpy(dtype=np.float32)
+        return
+    options = pa_csv.ConvertOptions(include_columns=[column], column_types={column: pa.float32()})
+    for batch in pa_csv.open_csv(source, convert_options=options):
+        yield batch.column(0).to_numpy(zero_copy_only=False)
+
+
+def iter_windows(chunks, window=WINDOW_SAMPLES, hop=WINDOW_SAMPLES, max_windows=8192):
+    """
+    Yield (first_window_index, windows) over a signal arriving as `chunks` of samples. Window i
+    covers samples [i * hop, i * hop + window). `windows` is a (n, window) strided view into one
+    reused buffer - no window is copied - and is only valid until the next iteration. At most
+    max_windows windows are yielded at a time, so memory stays the same however long the signal.
+    Samples after the last full window are not used.
+    """
+    if not 1 <= hop <= window:
+        raise ValueError(f"hop must be between 1 and {window} samples")
+    capacity = (max_windows - 1) * hop + window
+    buffer = np.empty(capacity, dtype=np.float32)
+    itemsize = buffer.itemsize
+    filled = 0
+    first = 0
+
+    def windows_in(count):
+        # Writeable so torch.from_numpy takes it without a warning - nothing writes through it
+        return np.lib.stride_tricks.as_strided(buffer, (count, window), (hop * itemsize, itemsize))
+
+    for chunk in chunks:
+        position = 0
+        while position < len(chunk):
+            taken = min(capacity - filled, len(chunk) - position)
+            buffer[filled:filled + taken] = chunk[position:position + taken]
+            filled += taken
+            position += taken
+            if filled == capacity:
+                yield first, windows_in(max_windows)
+                first += max_windows
+                # Keep the samples the next windows share with these ones
+                consumed = max_windows * hop
+                buffer[:filled - consumed] = buffer[consumed:filled]
+                filled -= consumed
+    if filled >= window:
+        yield first, windows_in((filled - window) // hop + 1)
+
+
+def iter_signal_predictions(chunks, model, device, hop=WINDOW_SAMPLES, batch_size=1024, max_windows=8192):
+    """Yield (first_window_index, probabilities) for the sliding windows over a continuous signal"""
+    for first, windows in iter_windows(chunks, WINDOW_SAMPLES, hop, max_windows):
+        # Fancy indexing copies the windows out of the shared buffer, in the order CSV rows are fed
+        yield first, predict_probabilities(model, windows[:, SERVED_SAMPLE_ORDER], device, batch_size)
+
+
+class SeizureEvents:
+    """
+    Seizure intervals of a recording, built from its window probabilities as they arrive: windows
+    at or above the threshold that overlap or touch are merged into one event.
+    """
+
+    def __init__(self, hop, sample_rate, window=WINDOW_SAMPLES, threshold=SEIZURE_THRESHOLD):
+        self.hop = hop
+        self.sample_rate = sample_rate
+        self.window = window
+        self.threshold = threshold
+        self.count = 0
+        self._finished = []
+        self._open = None  # [start sample, end sample, peak probability, windows]
+
+    def update(self, first_window, probs):
+        above = np.flatnonzero(probs >= self.threshold)
+        if len(above) == 0:
+            return
+        # Runs of seizure windows close enough to overlap or touch
+        breaks = np.flatnonzero(np.diff(above) * self.hop > self.window) + 1
+        for run in np.split(above, breaks):
+            start = int(first_window + run[0]) * self.hop
+            end = int(first_window + run[-1]) * self.hop + self.window
+            peak = float(probs[run].max())
+            if self._open is not None and start <= self._open[1]:
+                self._open[1] = end
+                self._open[2] = max(self._open[2], peak)
+                self._open[3] += len(run)
+            else:
+                self._close()
+                self._open = [start, end, peak, len(run)]
+
+    def _close(self):
+        if self._open is not None:
+            start, end, peak, windows = self._open
+            self._finished.append({
+                "start_sample": start,
+                "end_sample": end,
+                "start_seconds": round(start / self.sample_rate, 3),
+                "end_seconds": round(end / self.sample_rate, 3),
+                "peak_probability": peak,
+                "windows": windows,
+            })
+            self.count += 1
+            self._open = None
+
+    def take_finished(self, final=False):
+        """Events that can no longer grow since the last call (every remaining one when `final`)"""
+        if final:
+            self._close()
+        events, self._finished = self._finished, []
+        return events
+
+
+class SeizureSummary:
+    """Running aggregate over the per-segment probabilities of a recording"""
+
+    def __init__(self, keep_probabilities=True):
+        self.keep_probabilities = keep_probabilities
+        self.segments = 0
+        self.seizure_count = 0
+        self.max_probability = None
+        self.probability_sum = 0.0
+        self.probabilities = []
+
+    def update(self, probs):
+        if len(probs) == 0:
+            return
+        self.segments += len(probs)
+        self.seizure_count += int((probs >= SEIZURE_THRESHOLD).sum())
+        batch_max = float(probs.max())
+        if self.max_probability is None or batch_max > self.max_probability:
+            self.max_probability = batch_max
+        self.probability_sum += float(probs.sum(dtype=np.float64))
+        if self.keep_probabilities:
+            self.probabilities.extend(probs.tolist())
+
+    def to_dict(self):
+        summary = {
+            "segments": self.segments,
+            "seizure_count": self.seizure_count,
+            "non_seizure_count": self.segments - self.seizure_count,
+            "max_probability": self.max_probability,
+            "mean_probability": self.probability_sum / self.segments if self.segments else None,
+            "threshold": SEIZURE_THRESHOLD,
+        }
+        if self.keep_probabilities:
+            summary["probabilities"] = self.probabilities
+        return summary
@@ -0,0 +1,174 @@
+import copy
+import time
+
+import torch
+import torch.nn as nn
+
+from architectures import example_input
+
+# CPU execution profile for the eager models (applied at load by app.py, see CPU_PROFILE_MODELS):
+#   inference_mode - forward passes run under torch.inference_mode instead of no_grad
+#   fold_bn        - each BatchNorm that directly follows a convolution is folded into its weights
+#   channels_last  - image models and their inputs use the NHWC layout oneDNN's conv kernels prefer
+#   compile        - optionally torch.compile, warmed up for batch sizes 1..N at load time
+# The profiled model is compared with the model as loaded before it is used.
+
+
+def _detached_copy(model):
+    """
+    Copy of the module tree whose parameters and buffers are new tensors over the same storage,
+    so changes to the copy (new layers, new parameter tensors) never reach the original. The weights
+    themselves aren't copied - they may be memory-mapped from the weight store and shared between models.
+    """
+    memo = {id(param): nn.Parameter(param.detach(), requires_grad=param.requires_grad)
+            for param in model.parameters()}
+    memo.update({id(buffer): buffer.detach() for buffer in model.buffers()})
+    return copy.deepcopy(model, memo)
+
+
+def _batchnorm_replacement(bn):
+    """What's left of a BatchNorm once folded into the preceding conv, or None if it can't be folded"""
+    if type(bn) is nn.BatchNorm2d:
+        return nn.Identity()
+    if hasattr(bn, "act") and hasattr(bn, "drop"):
+        # timm's BatchNormAct2d: batch norm, then dropout and activation
+        return nn.Sequential(bn.drop, bn.act)
+    return None
+
+
+def _conv_batchnorm_pairs(model, example):
+    """(conv, bn) pairs where the BatchNorm's input is the convolution's output when `example` is run"""
+    conv_outputs = {}
+    pairs = []
+
+    def record_conv(module, inputs, output):
+        conv_outputs[id(output)] = (module, output)
+
+    def record_bn(module, inputs, output):
+        conv, conv_output = conv_outputs.get(id(inputs[0]), (None, None))
+        if conv is not None and conv_output is inputs[0]:
+            pairs.append((conv, module))
+
+    hooks = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            hooks.append(module.register_forward_hook(record_conv))
+        elif isinstance(module, nn.BatchNorm2d):
+            hooks.append(module.register_forward_hook(record_bn))
+    try:
+        with torch.no_grad():
+            model(example)
+    finally:
+        for hook in hooks:
+            hook.remove()
+    # A layer run more than once in the forward pass can't be folded
+    convs = [id(conv) for conv, _ in pairs]
+    bns = [id(bn) for _, bn in pairs]
+    return [(conv, bn) for conv, bn in pairs if convs.count(id(conv)) == 1 and bns.count(id(bn)) == 1]
+
+
+def fold_batchnorm(model, example):
+    """
+    Copy of `model` (see _detached_copy) with each BatchNorm that directly follows a convolution
+    folded into that convolution's weight and bias. Returns (model, number of BatchNorms folded).
+    """
+    model = _detached_copy(model)
+    parents = {id(child): (parent, name) for parent in model.modules() for name, child in parent.named_children()}
+    folded = 0
+    for conv, bn in _conv_batchnorm_pairs(model, example):
+        replacement = _batchnorm_replacement(bn)
+        if replacement is None or bn.running_mean is None or id(bn) not in parents:
+            continue
+        with torch.no_grad():
+            scale = torch.rsqrt(bn.running_var + bn.eps)
+            if bn.weight is not None:
+                scale = scale * bn.weight
+            shift = -bn.running_mean * scale
+            if bn.bias is not None:
+                shift = shift + bn.bias
+            weight = conv.weight * scale.reshape(-1, *([1] * (conv.weight.dim() - 1)))
+            bias = shift if conv.bias is None else conv.bias * scale + shift
+        # New tensors - the loaded ones are left untouched
+        conv.weight = nn.Parameter(weight, requires_grad=False)
+        conv.bias = nn.Parameter(bias, requires_grad=False)
+        parent, name = parents[id(bn)]
+        setattr(parent, name, replacement)
+        folded += 1
+    return model, folded
+
+
+class ProfiledModel:
+    """Callable like the model it wraps: runs it under inference_mode, with channels_last image inputs"""
+
+    def __init__(self, model, channels_last):
+        self.model = model
+        self.channels_last = channels_last
+
+    def __call__(self, tensor):
+        with torch.inference_mode():
+            if self.channels_last and tensor.dim() == 4:
+                tensor = tensor.contiguous(memory_format=torch.channels_last)
+            return self.model(tensor)
+
+
+def _max_difference(output, reference):
+    """Largest difference between two outputs, relative to the size of the reference values (at least 1)"""
+    scale = max(1.0, float(reference.abs().max()))
+    return float((output.float() - reference.float()).abs().max()) / scale
+
+
+def apply_cpu_profile(name, model, device, compile=False, warmup_batch=1, tolerance=1e-3):
+    """
+    The CPU execution profile applied to the eager model `name`. Returns (model, report): the
+    profiled model, or `model` itself when the profile isn't used (not on the CPU, or its outputs
+    differ from the original's by more than `tolerance`), and a dict describing what was applied.
+    """
+    if device.type != "cpu":
+        print(f"CPU execution profile for {name} skipped on {device}")
+        return model, None
+    started = time.perf_counter()
+    with torch.random.fork_rng(devices=[]):
+        torch.manual_seed(0)
+        example = example_input(name, 2).to(device)
+    with torch.no_grad():
+        reference = model(example)
+
+    report = {"applied": False, "bn_folded": 0, "channels_last": False, "compiled": False}
+    try:
+        profiled, report["bn_folded"] = fold_batchnorm(model, example[:1])
+    except Exception as e:
+        print(f"CPU execution profile failed for {name}: {e}, serving it unprofiled")
+        report["error"] = str(e)
+        return model, report
+    if example.dim() == 4:
+        profiled.to(memory_format=torch.channels_last)
+        try:
+            ProfiledModel(profiled, True)(example[:1])
+            report["channels_last"] = True
+        except RuntimeError as e:
+            # e.g. a .view() that needs the default layout
+            print(f"{name} can't run channels_last ({e}), keeping the default layout")
+            profiled.to(memory_format=torch.contiguous_format)
+    if compile:
+        try:
+            compiled = ProfiledModel(torch.compile(profiled), report["channels_last"])
+            # Compile for every batch size it will be called with now rather than on the first requests
+            for batch_size in range(1, warmup_batch + 1):
+                compiled(example_input(name, batch_size).to(device))
+            profiled = compiled
+            report["compiled"] = True
+        except Exception as e:
+            print(f"torch.compile failed for {name}: {e}, running it uncompiled")
+    if not isinstance(profiled, ProfiledModel):
+        profiled = ProfiledModel(profiled, report["channels_last"])
+
+    report["max_difference"] = _max_difference(profiled(example), reference)
+    report["setup_seconds"] = round(time.perf_counter() - started, 3)
+    if report["max_difference"] > tolerance:
+        print(f"CPU execution profile changes the outputs of {name} by {report['max_difference']:.2e} "
+              f"(tolerance {tolerance:.0e}), serving it unprofiled")
+        return model, report
+    report["applied"] = True
+    print(f"Serving {name} with the CPU execution profile ({report['bn_folded']} BatchNorms folded, "
+          f"channels_last={report['channels_last']}, compiled={report['compiled']})")
+    return profiled, report
@@ -0,0 +1,116 @@
+"""
+Export the pipeline models to TorchScript and/or ONNX for serving with INFERENCE_BACKEND.
+
+    python export_models.py                              # every model, both formats
+    python export_models.py --format onnx --models stage1 stage2 cancer_lung
+
+Each model is loaded exactly as app.py loads it (model_loading.py), exported, then run on random inputs
+next to the eager model so the exported outputs can be checked against the originals.
+Exports whose outputs differ by more than --atol are reported as failed and removed,
+so the server falls back to eager PyTorch for those models.
+"""
+import argparse
+import inspect
+import json
+import os
+import time
+
+import torch
+
+from architectures import example_input
+from inference_backend import OnnxModel, exported_path
+from model_loading import MODEL_NAMES, load_model
+
+
+def export_torchscript(model, example, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, path)
+    loaded = torch.jit.load(path, map_location="cpu")
+    loaded.eval()
+    return loaded
+
+
+def export_onnx(model, example, path, opset):
+    kwargs = dict(input_names=["input"], output_names=["output"],
+                  dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+                  opset_version=opset, do_constant_folding=True)
+    # Newer PyTorch defaults to the dynamo exporter - keep the TorchScript-based one, which
+    # handles dynamic_axes and needs no extra packages
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(model, (example,), path, **kwargs)
+    return OnnxModel(path, torch.device("cpu"))
+
+
+def parity(eager, exported, name, batch_sizes, atol):
+    """Max absolute difference between eager and exported outputs over random inputs"""
+    max_diff = 0.0
+    torch.manual_seed(0)
+    with torch.no_grad():
+        for batch_size in batch_sizes:
+            example = example_input(name, batch_size)
+            expected = eager(example).reshape(batch_size, -1)
+            actual = exported(example).reshape(batch_size, -1)
+            max_diff = max(max_diff, (expected - actual).abs().max().item())
+    return {"max_abs_diff": max_diff, "passed": max_diff <= atol}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODEL_NAMES, choices=MODEL_NAMES)
+    parser.add_argument("--format", nargs="+", dest="formats", default=["torchscript", "onnx"],
+                        choices=["torchscript", "onnx"])
+    parser.add_argument("--out", default=os.environ.get("EXPORT_DIR", "./AI-Models/exported"), help="output directory (default: %(default)s)")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-4, help="parity tolerance (default: %(default)s)")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    device = torch.device("cpu")
+    report = {}
+    for name in args.models:
+        eager = load_model(name, device)
+        if eager is None:
+            print(f"[{name}] could not be loaded, skipping")
+            report[name] = {"error": "model could not be loaded"}
+            continue
+        # Trace with a batch of 2 so the batch dimension isn't specialised away
+        example = example_input(name, 2)
+        report[name] = {}
+        for backend in args.formats:
+            path = exported_path(args.out, name, backend)
+            start = time.perf_counter()
+            try:
+                if backend == "torchscript":
+                    exported = export_torchscript(eager, example, path)
+                else:
+                    exported = export_onnx(eager, example, path, args.opset)
+                result = parity(eager, exported, name, [1, 2, 4], args.atol)
+            except Exception as e:
+                result = {"error": str(e), "passed": False}
+            result["export_seconds"] = round(time.perf_counter() - start, 2)
+            result["path"] = path
+            if not result["passed"] and os.path.exists(path):
+                # Don't leave a mismatching graph where the server would pick it up
+                os.remove(path)
+                result["removed"] = True
+            report[name][backend] = result
+            status = "ok" if result["passed"] else "FAILED"
+            print(f"[{name}] {backend}: {status} {result.get('max_abs_diff', result.get('error'))}")
+
+    report_path = os.path.join(args.out, "export_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {report_path}")
+    failed = [name for name, results in report.items()
+              if "error" in results or not all(r["passed"] for r in results.values())]
+    if failed:
+        print(f"Parity check failed for: {', '.join(failed)} - these will not match eager outputs")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Production gunicorn config for the Flask inference service (app.py)
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The app (and every model) is loaded in the master before forking, so the model weights
+# are shared copy-on-write between workers instead of being loaded again in each process.
+# Each worker gets its own slice of the CPU cores for PyTorch intra-op threads, so that
+# workers x torch threads ~= cores and the workers don't oversubscribe the CPU.
+import gc
+import os
+
+cpu_cores = int(os.environ.get("CPU_CORES", os.cpu_count() or 1))
+# Knob for the worker/thread ratio: PyTorch threads per worker process
+torch_threads = int(os.environ.get("TORCH_THREADS_PER_WORKER", 2))
+torch_threads = max(1, min(torch_threads, cpu_cores))
+
+# PIN_WORKER_CPUS=1 also pins each worker to its own torch_threads cores, so a worker's PyTorch
+# threads stay on the same cores (and caches) instead of migrating between them. Needs Linux
+# and at least workers x torch_threads cores available to the server.
+pin_worker_cpus = os.environ.get("PIN_WORKER_CPUS", "0") == "1"
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", max(1, cpu_cores // torch_threads)))
+worker_class = "gthread"
+# Request threads per worker - extra threads let uploads and cached results be handled
+# while another request is in a forward pass (and feed the micro-batcher)
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Set GUNICORN_PRELOAD=0 on GPU hosts - CUDA can't be initialised before forking. For the fastest
+# cold start, combine GUNICORN_PRELOAD=0 with BACKGROUND_MODEL_LOADING=1: each worker then accepts
+# requests immediately and loads its models in the background (at the cost of no sharing).
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+if preload_app:
+    # Load the disease-specific models in the master too, so they are shared as well
+    # (not with MODEL_SHARDS - then each worker loads only its own shard after the fork)
+    os.environ.setdefault("WARMUP_FINAL_MODELS", "1")
+
+
+def when_ready(server):
+    if preload_app:
+        # With BACKGROUND_MODEL_LOADING=1 the models may still be loading - finish before forking
+        # so the workers share them (threads don't survive the fork)
+        import app
+        app.model_loader.wait()
+    # Move everything loaded so far into the permanent generation so the garbage
+    # collector doesn't touch (and copy) those pages in the workers
+    gc.freeze()
+    server.log.info(f"{workers} workers x {torch_threads} torch threads on {cpu_cores} cores")
+
+
+def pre_fork(server, worker):
+    # Give the new worker the lowest CPU slot not held by a live worker (a replacement worker
+    # takes over the slot of the one it replaces)
+    used = {getattr(other, "cpu_slot", None) for other in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+
+
+def post_fork(server, worker):
+    import torch
+    if pin_worker_cpus and hasattr(os, "sched_setaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+        slot_cores = cores[worker.cpu_slot * torch_threads:(worker.cpu_slot + 1) * torch_threads]
+        if len(slot_cores) == torch_threads:
+            os.sched_setaffinity(0, slot_cores)
+            server.log.info(f"Worker {os.getpid()} pinned to cores {slot_cores}")
+        else:
+            server.log.warning(f"Not enough cores to pin worker {os.getpid()} (slot {worker.cpu_slot})")
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already set (or parallel work already started) in this process
+        pass
+
+
+def post_worker_init(worker):
+    # Start the background job workers (so jobs queued or interrupted before a restart resume)
+    # and, with MODEL_SHARDS, claim a model shard for this worker
+    import app
+    app.start_worker_threads()
@@ -0,0 +1,56 @@
+import os
+
+import torch
+
+# Serving backends: eager PyTorch modules, or the graphs written by export_models.py
+BACKENDS = ("eager", "torchscript", "onnx")
+
+
+def exported_path(export_dir, name, backend):
+    extension = ".pt" if backend == "torchscript" else ".onnx"
+    return os.path.join(export_dir, name + extension)
+
+
+class OnnxModel:
+    """ONNX Runtime session that can be called like the nn.Module it was exported from"""
+
+    def __init__(self, path, device, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        if device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = device
+
+    def __call__(self, tensor):
+        output = self.session.run(None, {self.input_name: tensor.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output).to(self.device)
+
+
+def load_exported(name, backend, export_dir, device):
+    """Exported graph for model `name`, or None when it isn't available so the caller can fall back to eager"""
+    if backend == "eager":
+        return None
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend {backend}, using eager PyTorch")
+        return None
+    path = exported_path(export_dir, name, backend)
+    if not os.path.exists(path):
+        print(f"No {backend} export for {name} at {path}, using eager PyTorch")
+        return None
+    try:
+        if backend == "torchscript":
+            model = torch.jit.load(path, map_location=device)
+            model.eval()
+        else:
+            model = OnnxModel(path, device, threads=torch.get_num_threads())
+        print(f"Serving {name} with {backend} from {path}")
+        return model
+    except Exception as e:
+        print(f"Failed to load {backend} export for {name}: {e}, using eager PyTorch")
+        return None
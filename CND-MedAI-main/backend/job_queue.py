@@ -0,0 +1,356 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobLost(Exception):
+    """The job was taken over by another worker (this one was presumed dead)"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    """A claimed job, passed to its handler to read the inputs and report progress and results"""
+
+    def __init__(self, queue, job_id, kind, params):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.input_dir = queue.input_dir(job_id)
+
+    def inputs(self):
+        """(original filename, path) of each uploaded file, in upload order"""
+        return [(name, os.path.join(self.input_dir, stored)) for name, stored in self.params["files"]]
+
+    def emit(self, results, processed=None, total=None):
+        """Append results (visible to clients straight away) and update the progress"""
+        self.queue._append(self, results, processed, total)
+
+
+class JobQueue:
+    """
+    Queue of long-running jobs kept in a SQLite file, run by worker threads in the app's own
+    processes - no broker. Uploaded inputs are copied to `directory` so queued jobs survive a
+    restart, and results are stored as they are produced so clients can read partial results.
+
+    At most `max_running` jobs run at once across every process sharing the database. A job
+    whose process died (or that stopped reporting progress for `stale_after` seconds) is queued
+    again and restarted from the beginning, up to `max_attempts` times. Finished jobs are
+    deleted `retention` seconds after they finish.
+
+    Jobs are owned by a token made each time a process starts its workers, not by the pid alone:
+    a restarted server often gets the pid of the one before it (pid 1 in a container).
+    """
+
+    def __init__(self, directory, handlers, max_running=1, max_queued=100, max_attempts=3,
+                 stale_after=600, retention=24 * 3600, poll_interval=1.0):
+        self.directory = directory
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+        self.handlers = handlers
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._workers = []
+        self._workers_pid = None
+        self._owner = None
+        self._running = set()
+        self._wakeup = threading.Event()
+        self._maintained_at = 0.0
+
+    def _connection(self):
+        # Caller must hold self._lock. One connection per process (connections must not cross a fork).
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            # Autocommit - transactions are opened explicitly with BEGIN IMMEDIATE
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, attempts INTEGER DEFAULT 0, "
+                "owner INTEGER, created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL, "
+                "processed INTEGER DEFAULT 0, total INTEGER, result_count INTEGER DEFAULT 0, "
+                "summary TEXT, error TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_results ("
+                "job_id TEXT, seq INTEGER, value TEXT, PRIMARY KEY (job_id, seq))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if "owner_token" not in columns:
+                # Databases created before jobs were owned by a token
+                self._db.execute("ALTER TABLE jobs ADD COLUMN owner_token TEXT")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _transaction(self, fn):
+        with self._lock:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    def input_dir(self, job_id):
+        return os.path.join(self.directory, "inputs", job_id)
+
+    # ---- submitting and reading jobs (request threads) ----
+    def submit(self, kind, uploads, params=None):
+        """
+        Queue a job for the `kind` handler with the given (filename, stream) uploads.
+        Returns the job id, or None when max_queued jobs are already waiting.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        # Cheap early check so uploads aren't copied for nothing - the insert below checks again
+        if self.counts().get(QUEUED, 0) >= self.max_queued:
+            return None
+        job_id = uuid.uuid4().hex
+        input_dir = self.input_dir(job_id)
+        os.makedirs(input_dir)
+        files = []
+        for index, (name, stream) in enumerate(uploads):
+            stored = f"{index:04d}"
+            with open(os.path.join(input_dir, stored), "wb") as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+            files.append((name, stored))
+        params = {**(params or {}), "files": files}
+
+        def insert(db):
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                return False
+            db.execute("INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                       (job_id, kind, json.dumps(params), QUEUED, time.time()))
+            return True
+        try:
+            inserted = self._transaction(insert)
+        except BaseException:
+            shutil.rmtree(input_dir, ignore_errors=True)
+            raise
+        if not inserted:
+            shutil.rmtree(input_dir, ignore_errors=True)
+            return None
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Status and progress of a job, or None if it doesn't exist"""
+        with self._lock:
+            db = self._connection()
+            row = db.execute(
+                "SELECT kind, status, attempts, created_at, started_at, finished_at, processed, total, "
+                "result_count, summary, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            kind, status, attempts, created_at, started_at, finished_at, processed, total, \
+                result_count, summary, error = row
+            job = {
+                "job_id": job_id,
+                "kind": kind,
+                "status": status,
+                "attempts": attempts,
+                "created_at": created_at,
+                "started_at": started_at,
+                "finished_at": finished_at,
+                "progress": {
+                    "processed": processed,
+                    "total": total,
+                    "fraction": round(min(processed / total, 1.0), 4) if total else None,
+                },
+                "result_count": result_count,
+            }
+            if status == QUEUED:
+                job["queue_position"] = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, created_at)).fetchone()[0]
+        if summary is not None:
+            job["summary"] = json.loads(summary)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def results(self, job_id, offset=0, limit=1000):
+        """Results of a job from position `offset` on - the partial results while it is still running"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT value FROM job_results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit)).fetchall()
+        return [json.loads(value) for value, in rows]
+
+    def counts(self):
+        """Number of jobs in each status"""
+        with self._lock:
+            rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    # ---- workers ----
+    def start(self, workers=None):
+        """Start the worker threads of this process (again after a fork). Safe to call repeatedly."""
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self._owner = uuid.uuid4().hex
+            self._running = set()
+            self._wakeup = threading.Event()
+            self._workers = []
+            for i in range(workers or self.max_running):
+                worker = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _run(self):
+        # Nothing may end this loop - start() doesn't replace a worker thread that died
+        while True:
+            try:
+                self._maintain()
+                job = self._claim()
+            except Exception as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._execute(job)
+            except Exception as e:
+                # e.g. the database was unavailable when the job finished
+                print(f"Job {job.id} ({job.kind}) could not be completed: {e}")
+                try:
+                    self._finish(job, FAILED, error=str(e))
+                except Exception as e:
+                    # Left to _maintain, which requeues jobs this process isn't running
+                    print(f"Job {job.id} could not be marked failed: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(job.id)
+
+    def _claim(self):
+        def claim(db):
+            running = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+            if running >= self.max_running:
+                return None
+            row = db.execute("SELECT id, kind, params FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                             (QUEUED,)).fetchone()
+            if row is None:
+                return None
+            job_id, kind, params = row
+            now = time.time()
+            db.execute(
+                "UPDATE jobs SET status = ?, owner = ?, owner_token = ?, attempts = attempts + 1, started_at = ?, "
+                "heartbeat_at = ?, processed = 0, result_count = 0 WHERE id = ?",
+                (RUNNING, os.getpid(), self._owner, now, now, job_id))
+            # A restarted job starts over
+            db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+            self._running.add(job_id)
+            return Job(self, job_id, kind, json.loads(params))
+        return self._transaction(claim)
+
+    def _execute(self, job):
+        try:
+            summary = self.handlers[job.kind](job)
+            self._finish(job, DONE, summary=summary)
+        except JobLost:
+            print(f"Job {job.id} was taken over by another worker")
+            return
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            try:
+                self._finish(job, FAILED, error=str(e))
+            except JobLost:
+                return
+        shutil.rmtree(job.input_dir, ignore_errors=True)
+
+    def _append(self, job, results, processed, total):
+        def append(db):
+            owned = db.execute("SELECT result_count FROM jobs WHERE id = ? AND status = ? AND owner_token = ?",
+                               (job.id, RUNNING, self._owner)).fetchone()
+            if owned is None:
+                raise JobLost(job.id)
+            start = owned[0]
+            db.executemany("INSERT INTO job_results (job_id, seq, value) VALUES (?, ?, ?)",
+                           [(job.id, start + i, json.dumps(result)) for i, result in enumerate(results)])
+            db.execute(
+                "UPDATE jobs SET result_count = ?, heartbeat_at = ?, processed = COALESCE(?, processed), "
+                "total = COALESCE(?, total) WHERE id = ?",
+                (start + len(results), time.time(), processed, total, job.id))
+        self._transaction(append)
+
+    def _finish(self, job, status, summary=None, error=None):
+        def finish(db):
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, summary = ?, error = ? "
+                "WHERE id = ? AND status = ? AND owner_token = ?",
+                (status, time.time(), json.dumps(summary) if summary is not None else None, error,
+                 job.id, RUNNING, self._owner))
+            if updated.rowcount == 0:
+                raise JobLost(job.id)
+        self._transaction(finish)
+
+    def _maintain(self):
+        """Requeue the jobs of dead workers and delete expired jobs (at most every few seconds)"""
+        now = time.time()
+        if now - self._maintained_at < max(self.poll_interval, 5.0):
+            return
+        self._maintained_at = now
+
+        def maintain(db):
+            expired = []
+            for job_id, owner, owner_token, attempts, heartbeat_at in db.execute(
+                    "SELECT id, owner, owner_token, attempts, heartbeat_at FROM jobs WHERE status = ?",
+                    (RUNNING,)).fetchall():
+                if owner_token == self._owner:
+                    if job_id in self._running:
+                        continue
+                    # Ours, but no worker of this process is running it any more
+                elif owner != os.getpid() and _pid_alive(owner) and now - (heartbeat_at or 0) < self.stale_after:
+                    # Another live process (a job owned by our own pid under another token is
+                    # from a process that had this pid before)
+                    continue
+                if attempts >= self.max_attempts:
+                    db.execute("UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                               (FAILED, now, f"Interrupted {attempts} times", job_id))
+                    expired.append(job_id)
+                else:
+                    print(f"Requeueing job {job_id} (worker {owner} is gone)")
+                    db.execute("UPDATE jobs SET status = ?, owner = NULL, owner_token = NULL WHERE id = ?",
+                               (QUEUED, job_id))
+            old = [job_id for job_id, in db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (*FINISHED, now - self.retention)).fetchall()]
+            for job_id in old:
+                db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+                db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return expired + old
+        for job_id in self._transaction(maintain):
+            shutil.rmtree(self.input_dir(job_id), ignore_errors=True)
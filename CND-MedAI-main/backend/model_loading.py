@@ -0,0 +1,216 @@
+import os
+
+import torch
+
+from architectures import SimpleCNN, EpilepsyModel, build_stage2, build_stage3, build_final_model
+from execution_profile import apply_cpu_profile
+from inference_backend import load_exported
+from quantization import QUANTIZATION_MODES, load_quantized
+from weight_store import WeightStore, checkpoint_name
+
+# Loading the pipeline models from their checkpoints (architectures are defined in architectures.py).
+# Used by app.py and by the offline tools (export_models.py, quantize_models.py); importing this
+# module loads nothing - each checkpoint is read when its load_* function is called.
+#
+# Checkpoints converted by convert_weights.py are read from the weight store in WEIGHT_STORE_DIR:
+# memory-mapped, shared by every worker through the page cache, and without unpickling. A .pth that
+# isn't in the store, or changed after it was converted, is loaded with torch.load as before.
+WEIGHT_STORE_DIR = os.environ.get("WEIGHT_STORE_DIR", "./AI-Models/weights")
+weight_store = WeightStore(WEIGHT_STORE_DIR)
+
+# Map subtype to final diagnostic model file
+subtype_to_model = {
+    "cancer_breast": "./AI-Models/Breast.pth",
+    "cancer_colon": "./AI-Models/Colon.pth",
+    "cancer_lung": "./AI-Models/Lung.pth",
+    "neuro_alzheimers": "./AI-Models/Alzheimer.pth",
+    "neuro_ms": "./AI-Models/MultipleSclerosis.pth",
+}
+# Checkpoint of every model load_model() can load
+CHECKPOINTS = {
+    "stage1": "./AI-Models/1st_Pipeline.pth",
+    "stage2": "./AI-Models/2nd_Pipeline.pth",
+    "stage3": "./AI-Models/3rd_Pipeline.pth",
+    "epilepsy": "./AI-Models/Epilepsy.pth",
+    **subtype_to_model,
+}
+MODEL_NAMES = list(CHECKPOINTS)
+
+# How the models are served (read by app.py and benchmark.py, applied by load_served_model):
+#
+# INFERENCE_BACKEND=torchscript or onnx serves the graphs written by export_models.py (from
+# EXPORT_DIR) instead of the eager modules, falling back to eager for models without an export
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "./AI-Models/exported")
+
+# QUANTIZED_MODELS=stage1,epilepsy (or "all") serves the INT8 models written by quantize_models.py
+# (from QUANTIZED_DIR) for the listed models on CPU, falling back to fp32 when one isn't available
+QUANTIZED_MODELS = os.environ.get("QUANTIZED_MODELS", "")
+QUANTIZED_MODELS = set(QUANTIZATION_MODES) if QUANTIZED_MODELS == "all" else \
+    {name.strip() for name in QUANTIZED_MODELS.split(",") if name.strip()}
+QUANTIZED_DIR = os.environ.get("QUANTIZED_DIR", "./AI-Models/quantized")
+
+# CPU_PROFILE_MODELS=stage2,stage3 (or "all") runs the listed eager models with the CPU execution
+# profile in execution_profile.py: inference_mode, BatchNorm folded into the convolutions and
+# channels_last, plus torch.compile with CPU_PROFILE_COMPILE=1 (warmed up at load for batch sizes
+# 1..CPU_PROFILE_WARMUP_BATCH). A model whose profiled outputs differ from the loaded model's by
+# more than CPU_PROFILE_TOLERANCE is served unprofiled. /models/stats reports what was applied.
+CPU_PROFILE_MODELS = os.environ.get("CPU_PROFILE_MODELS", "")
+CPU_PROFILE_MODELS = set(MODEL_NAMES) if CPU_PROFILE_MODELS == "all" else \
+    {name.strip() for name in CPU_PROFILE_MODELS.split(",") if name.strip()}
+CPU_PROFILE_COMPILE = os.environ.get("CPU_PROFILE_COMPILE", "0") == "1"
+CPU_PROFILE_WARMUP_BATCH = int(os.environ.get("CPU_PROFILE_WARMUP_BATCH", os.environ.get("BATCH_MAX_SIZE", 8)))
+CPU_PROFILE_TOLERANCE = float(os.environ.get("CPU_PROFILE_TOLERANCE", 1e-3))
+cpu_profile_reports = {}
+
+
+def load_checkpoint(path, device):
+    """
+    (checkpoint, assign): the checkpoint from the weight store, else torch.load - memory-mapping
+    the file instead of reading it all into memory where supported. `assign` is true only for the
+    weight store, whose tensors are views of a private copy-on-write mapping and can become the
+    model's parameters as they are. A memory-mapped .pth has to be copied into the model: the
+    mapping follows the file, which may be overwritten in place while the app is running.
+    """
+    name = checkpoint_name(path)
+    if weight_store.is_current(name, path):
+        return weight_store.load(name, device), True
+    if name in weight_store:
+        print(f"{path} changed since it was converted to the weight store, loading the .pth")
+    try:
+        return torch.load(path, map_location=device, mmap=True), False
+    except (TypeError, RuntimeError):
+        # Older PyTorch without mmap, or a checkpoint in the legacy (non-zip) format
+        return torch.load(path, map_location=device), False
+
+
+def load_weights(model, state_dict, strict=True, assign=False):
+    """load_state_dict - with `assign`, the checkpoint's tensors become the parameters instead of being copied"""
+    if not assign:
+        return model.load_state_dict(state_dict, strict=strict)
+    try:
+        return model.load_state_dict(state_dict, strict=strict, assign=True)
+    except TypeError:
+        # PyTorch before 2.1
+        return model.load_state_dict(state_dict, strict=strict)
+
+
+def load_second_model(device):
+    model2 = build_stage2()
+    checkpoint, assign = load_checkpoint(CHECKPOINTS["stage2"], device)
+    load_weights(model2, checkpoint, assign=assign)
+    model2.to(device)
+    model2.eval()
+    return model2
+
+
+def load_third_model(device):
+    model3 = build_stage3()
+    checkpoint, assign = load_checkpoint(CHECKPOINTS["stage3"], device)
+    load_weights(model3, checkpoint, assign=assign)
+    model3.to(device)
+    model3.eval()
+    return model3
+
+
+def load_first_model(device):
+    model1 = SimpleCNN().to(device)
+    checkpoint, assign = load_checkpoint(CHECKPOINTS["stage1"], device)
+    load_weights(model1, checkpoint, assign=assign)
+    model1.eval()
+    return model1
+
+
+def load_epilepsy_model(device):
+    model = EpilepsyModel()
+    checkpoint, assign = load_checkpoint(CHECKPOINTS["epilepsy"], device)
+    load_weights(model, checkpoint, assign=assign)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def load_final_model(subtype, device):
+    """Load the disease-specific final diagnostic model"""
+    model_path = subtype_to_model.get(subtype)
+    if not model_path or not os.path.exists(model_path):
+        print(f"Model path not found: {model_path}")
+        return None
+
+    try:
+        checkpoint, assign = load_checkpoint(model_path, device)
+
+        # Print checkpoint structure for debugging
+        print(f"Loading {subtype} from {model_path}")
+        if isinstance(checkpoint, dict):
+            print(f"Checkpoint keys: {list(checkpoint.keys())[:10]}")
+            # Check if it's wrapped in a 'model' or 'state_dict' key
+            if 'state_dict' in checkpoint:
+                checkpoint = checkpoint['state_dict']
+            elif 'model' in checkpoint:
+                checkpoint = checkpoint['model']
+
+        # Load based on known architecture for each disease
+        model = build_final_model(subtype)
+        if model is None:
+            print(f"Unknown subtype: {subtype}")
+            return None
+
+        if subtype == "cancer_colon":
+            # Load checkpoint weights non-strictly to allow partial loading
+            model_state = model.state_dict()
+            for k in checkpoint:
+                if k in model_state and model_state[k].shape == checkpoint[k].shape:
+                    model_state[k] = checkpoint[k]
+            load_weights(model, model_state, assign=assign)
+        else:
+            load_weights(model, checkpoint, strict=False, assign=assign)
+
+        model.to(device)
+        model.eval()
+        print(f"Successfully loaded {subtype} model")
+        return model
+
+    except Exception as e:
+        print(f"Error loading model for {subtype}: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def load_model(name, device):
+    """The eager model `name` (stage1/2/3, epilepsy or a subtype), loaded from its checkpoint"""
+    if name == "stage1":
+        return load_first_model(device)
+    if name == "stage2":
+        return load_second_model(device)
+    if name == "stage3":
+        return load_third_model(device)
+    if name == "epilepsy":
+        return load_epilepsy_model(device)
+    return load_final_model(name, device)
+
+
+def with_cpu_profile(name, model, device):
+    if model is None or name not in CPU_PROFILE_MODELS:
+        return model
+    model, report = apply_cpu_profile(name, model, device, compile=CPU_PROFILE_COMPILE,
+                                      warmup_batch=CPU_PROFILE_WARMUP_BATCH, tolerance=CPU_PROFILE_TOLERANCE)
+    if report is not None:
+        cpu_profile_reports[name] = report
+    return model
+
+
+def with_backend(name, device, load_eager):
+    """The quantized or exported model `name` when configured and available, else `load_eager()` (profiled)"""
+    if name in QUANTIZED_MODELS:
+        quantized = load_quantized(name, QUANTIZED_DIR, device)
+        if quantized is not None:
+            return quantized
+    exported = load_exported(name, INFERENCE_BACKEND, EXPORT_DIR, device)
+    return exported if exported is not None else with_cpu_profile(name, load_eager(), device)
+
+
+def load_served_model(name, device):
+    """The model `name` as the app serves it, with the backend configured above"""
+    return with_backend(name, device, lambda: load_model(name, device))
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models keyed by name (e.g. the subtype).
+    Keeps at most `max_size` models resident and evicts the least recently used one.
+    Loading is single-flight: concurrent first requests for the same key wait for
+    one load instead of each calling the loader.
+    """
+
+    def __init__(self, loader, max_size=None, name="models"):
+        self.loader = loader
+        self.max_size = max_size
+        self.name = name
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.evictions = 0
+        self.load_times = {}
+
+    def get(self, key):
+        """Return the model for `key`, loading it on first use. Returns None if loading fails."""
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key]
+            self.misses += 1
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._loading[key] = event
+
+        if not owner:
+            # Another thread is already loading this model - wait for it
+            event.wait()
+            with self._lock:
+                model = self._models.get(key)
+                if model is not None:
+                    self._models.move_to_end(key)
+                return model
+
+        model = None
+        start = time.perf_counter()
+        try:
+            model = self.loader(key)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.loads += 1
+                if model is None:
+                    self.load_failures += 1
+                else:
+                    self.load_times[key] = round(elapsed, 4)
+                    self._models[key] = model
+                    self._models.move_to_end(key)
+                    self._evict()
+                del self._loading[key]
+            event.set()
+        return model
+
+    def _evict(self):
+        # Caller must hold self._lock
+        if self.max_size is None:
+            return
+        while len(self._models) > self.max_size:
+            evicted, _ = self._models.popitem(last=False)
+            self.evictions += 1
+            print(f"[{self.name}] Evicted {evicted} from model cache")
+
+    def evict(self, key):
+        with self._lock:
+            return self._models.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "resident": list(self._models.keys()),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+                "evictions": self.evictions,
+                "load_time_seconds": dict(self.load_times),
+            }
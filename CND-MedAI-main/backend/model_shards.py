@@ -0,0 +1,318 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+_DTYPES = {str(dtype).replace("torch.", ""): dtype
+           for dtype in (torch.float32, torch.float16, torch.bfloat16, torch.float64, torch.int64)}
+
+
+def parse_shards(spec):
+    """'cancer_breast,cancer_colon;neuro_ms' -> [['cancer_breast', 'cancer_colon'], ['neuro_ms']]"""
+    groups = [[name.strip() for name in group.split(",") if name.strip()] for group in spec.split(";")]
+    return [group for group in groups if group]
+
+
+class ShardError(Exception):
+    """The shard answered, but with an error"""
+
+
+# ---- wire format: 4-byte length + JSON header, then header["nbytes"] bytes of tensor data ----
+def _send(sock, header, payload=b""):
+    data = json.dumps({**header, "nbytes": len(payload)}).encode()
+    sock.sendall(struct.pack("<I", len(data)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed")
+        received += count
+    return buffer
+
+
+def _recv(sock):
+    size, = struct.unpack("<I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, size))
+    payload = _recv_exact(sock, header["nbytes"]) if header["nbytes"] else bytearray()
+    return header, payload
+
+
+def _tensor_message(tensor):
+    tensor = tensor.detach().cpu().contiguous()
+    header = {"dtype": str(tensor.dtype).replace("torch.", ""), "shape": list(tensor.shape)}
+    return header, tensor.reshape(-1).view(torch.uint8).numpy().tobytes()
+
+
+def _message_tensor(header, payload):
+    dtype = _DTYPES[header["dtype"]]
+    if not payload:
+        return torch.empty(header["shape"], dtype=dtype)
+    return torch.frombuffer(payload, dtype=dtype).view(header["shape"])
+
+
+class _ShardRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # One connection per client thread, kept open for many requests
+        while True:
+            try:
+                header, payload = _recv(self.request)
+            except (ConnectionError, OSError, struct.error):
+                return
+            self.server.shards._serve(self.request, header, payload)
+
+
+class _ShardServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ShardClient:
+    """Connection to the worker hosting one shard. After a failure the shard is skipped for `retry_seconds`."""
+
+    def __init__(self, socket_path, retry_seconds=5.0, timeout=60.0):
+        self.socket_path = socket_path
+        self.retry_seconds = retry_seconds
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down_until = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def mark_down(self):
+        self.failures += 1
+        self._down_until = time.monotonic() + self.retry_seconds
+        self._close()
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _socket(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None or getattr(self._local, "pid", None) != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _request(self, header, payload):
+        sock = self._socket()
+        try:
+            _send(sock, header, payload)
+            return _recv(sock)
+        except OSError:
+            self._close()
+            raise
+
+    def forward(self, model, tensor):
+        """
+        Output of the shard's `model` for `tensor`. Raises ConnectionError or FileNotFoundError when
+        the shard can't be reached, and TimeoutError when it doesn't answer within `timeout`.
+        """
+        header, payload = _tensor_message(tensor)
+        header = {"op": "forward", "model": model, **header}
+        reused = getattr(self._local, "sock", None) is not None and self._local.pid == os.getpid()
+        try:
+            response, data = self._request(header, payload)
+        except ConnectionError:
+            if not reused:
+                raise
+            # The connection may be to a worker that has since been replaced - retry on a new one
+            response, data = self._request(header, payload)
+        self.calls += 1
+        if not response.get("ok"):
+            raise ShardError(response.get("error", "shard error"))
+        return _message_tensor(response, data)
+
+
+class RemoteModel:
+    """
+    Callable like the final model it stands for, but runs it on the worker hosting its shard.
+    While that worker can't be reached the model is loaded and run locally; errors raised by the
+    model on the shard are raised as ShardError, and a shard that doesn't answer in time raises
+    TimeoutError.
+    """
+
+    def __init__(self, shards, subtype, client):
+        self.shards = shards
+        self.subtype = subtype
+        self.client = client
+        self.fallbacks = 0
+
+    def __call__(self, tensor):
+        if self.client.available():
+            try:
+                output = self.client.forward(self.subtype, tensor)
+                self.shards._release_fallback(self.subtype)
+                return output.to(tensor.device)
+            except (ConnectionError, FileNotFoundError) as e:
+                # Only an unreachable shard is skipped. A shard that times out is alive but busy (e.g.
+                # still loading its models) - loading its model here as well would break the per-shard
+                # memory budget, so the TimeoutError goes back to the caller, as does a ShardError (the
+                # model itself failed on this input, which running it locally wouldn't fix).
+                print(f"Shard for {self.subtype} at {self.client.socket_path} failed ({e}), running it locally")
+                self.client.mark_down()
+        self.fallbacks += 1
+        model = self.shards._load_fallback(self.subtype)
+        if model is None:
+            raise RuntimeError(f"Model not found for {self.subtype}")
+        return model(tensor)
+
+
+class ModelShards:
+    """
+    Spreads the final models over the worker processes: `groups` lists the models of each shard,
+    and each worker takes the first shard slot that is free (an flock on a file in `socket_dir`,
+    released when the worker exits, so a replacement worker takes over its shard). A worker
+    loads only the models of its own shard and serves them to the other workers on a Unix
+    socket. Other models are run through a RemoteModel, which falls back to loading them locally.
+    Workers beyond the number of shards host no models and route everything.
+
+    `load_local(name)` returns the local model (loading it if needed), `evict_local(name)` drops it,
+    and `forward(name, model, tensor)` runs a local model for a request from another worker.
+    """
+
+    def __init__(self, groups, socket_dir, load_local, evict_local, forward, retry_seconds=5.0, timeout=60.0):
+        self.groups = groups
+        self.socket_dir = socket_dir
+        self.load_local = load_local
+        self.evict_local = evict_local
+        self.forward = forward
+        self.slot = None
+        self._pid = None
+        self._lock_fd = None
+        self._server = None
+        self._fallback_loaded = set()
+        self._lock = threading.Lock()
+        self.clients = [ShardClient(self.socket_path(i), retry_seconds, timeout) for i in range(len(groups))]
+        self.remote_models = {}
+        for slot, group in enumerate(groups):
+            for name in group:
+                self.remote_models[name] = RemoteModel(self, name, self.clients[slot])
+        self.served = 0
+
+    def socket_path(self, slot):
+        return os.path.join(self.socket_dir, f"shard-{slot}.sock")
+
+    def hosted(self):
+        return set(self.groups[self.slot]) if self.slot is not None else set()
+
+    def start(self):
+        """Claim a free shard slot in this process and serve its models (again after a fork). Safe to call repeatedly."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.slot = None
+            if fcntl is None:
+                print("Model sharding needs fcntl (not available on this platform), every model runs locally")
+                return
+            os.makedirs(self.socket_dir, exist_ok=True)
+            for slot in range(len(self.groups)):
+                fd = os.open(os.path.join(self.socket_dir, f"shard-{slot}.lock"), os.O_CREAT | os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    continue
+                self._lock_fd = fd
+                self.slot = slot
+                break
+            if self.slot is None:
+                print(f"Worker {os.getpid()} hosts no model shard, routing every final model")
+                return
+            path = self.socket_path(self.slot)
+            if os.path.exists(path):
+                os.unlink(path)  # left behind by the worker that had this slot before
+            self._server = _ShardServer(path, _ShardRequestHandler)
+            self._server.shards = self
+            threading.Thread(target=self._server.serve_forever, name=f"shard-{self.slot}", daemon=True).start()
+            print(f"Worker {os.getpid()} hosts shard {self.slot}: {', '.join(self.groups[self.slot])}")
+            threading.Thread(target=self._warm_up, name=f"shard-{self.slot}-warmup", daemon=True).start()
+
+    def _warm_up(self):
+        for name in self.groups[self.slot]:
+            self.load_local(name)
+
+    def model(self, name):
+        """The model for `name`: local if this worker hosts it (or it's in no shard), else a RemoteModel"""
+        remote = self.remote_models.get(name)
+        if remote is None or name in self.hosted() or self._pid != os.getpid():
+            return self.load_local(name)
+        return remote
+
+    def _load_fallback(self, name):
+        model = self.load_local(name)
+        if model is not None:
+            with self._lock:
+                self._fallback_loaded.add(name)
+        return model
+
+    def _release_fallback(self, name):
+        # Shard is back - drop the local copy loaded while it was down
+        if name in self._fallback_loaded:
+            with self._lock:
+                self._fallback_loaded.discard(name)
+            self.evict_local(name)
+
+    def _serve(self, sock, header, payload):
+        name = header.get("model")
+        if header.get("op") != "forward" or name not in self.hosted():
+            _send(sock, {"ok": False, "error": f"{name} is not hosted by shard {self.slot}"})
+            return
+        try:
+            model = self.load_local(name)
+            if model is None:
+                raise RuntimeError(f"Model not found for {name}")
+            output = self.forward(name, model, _message_tensor(header, payload))
+            response, data = _tensor_message(output)
+            self.served += 1
+            _send(sock, {"ok": True, **response}, data)
+        except Exception as e:
+            print(f"Shard {self.slot} error running {name}: {e}")
+            _send(sock, {"ok": False, "error": str(e)})
+
+    def stats(self):
+        return {
+            "slot": self.slot,
+            "hosted": sorted(self.hosted()),
+            "served": self.served,
+            "local_fallbacks": sorted(self._fallback_loaded),
+            "shards": [
+                {
+                    "models": group,
+                    "socket": client.socket_path,
+                    "available": client.available(),
+                    "calls": client.calls,
+                    "failures": client.failures,
+                }
+                for group, client in zip(self.groups, self.clients)
+            ],
+        }
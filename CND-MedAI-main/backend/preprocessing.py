@@ -0,0 +1,120 @@
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Model input variants. Each one is a geometry (how the image is resized to 224x224) plus
+# the normalization applied to the 0-1 pixel values:
+#   normal  - resize to 224x224, ImageNet mean/std (stages 1 and 2, Breast, Alzheimer)
+#   half    - resize to 224x224, mean = std = 0.5 (MS, Lung, Colon)
+#   subtype - resize the short side to 256 and center crop 224, no normalization (stage 3)
+NORMAL = "normal"
+HALF = "half"
+SUBTYPE = "subtype"
+
+SQUARE = "square"
+CENTER_CROP = "center_crop"
+INPUT_SIZE = 224
+CROP_RESIZE = 256
+
+VARIANTS = {
+    NORMAL: (SQUARE, [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    HALF: (SQUARE, [0.5, 0.5, 0.5], [0.5, 0.5, 0.5]),
+    SUBTYPE: (CENTER_CROP, None, None),
+}
+_NORMALIZATION = {
+    name: (torch.tensor(mean).view(1, 3, 1, 1), torch.tensor(std).view(1, 3, 1, 1))
+    for name, (_, mean, std) in VARIANTS.items() if mean is not None
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def final_variant(subtype):
+    """Input variant matching the training normalization of each final model"""
+    if subtype == "neuro_ms":
+        # MS model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5] (matches notebook training)
+        return HALF
+    elif subtype == "cancer_lung":
+        # Lung model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5] (CTlung notebook)
+        return HALF
+    elif subtype == "cancer_colon":
+        # Colon model trained with mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5] (Colon_CT_Resnet18 notebook)
+        return HALF
+    # Other models (Breast, Alzheimer) use ImageNet normalization
+    return NORMAL
+
+
+def decode_image(source, draft=False):
+    """
+    Decode an uploaded image to RGB. With `draft`, large JPEGs are decoded at a reduced scale (1/2,
+    1/4 or 1/8, done by libjpeg while decoding) that still leaves every side at least CROP_RESIZE
+    pixels, so the full-resolution pixels are never produced only to be resized away. The pixels
+    differ slightly from a full decode, and so can the model outputs.
+    """
+    with Image.open(source) as raw:
+        if draft and raw.format == "JPEG":
+            raw.draft("RGB", (CROP_RESIZE, CROP_RESIZE))
+        return raw.convert("RGB")
+
+
+def resize_pixels(image, geometry):
+    """HxWx3 uint8 array of `image` resized the same way torchvision's Resize/CenterCrop do on PIL images"""
+    if geometry == SQUARE:
+        return np.array(image.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR))
+    width, height = image.size
+    short, long = (width, height) if width <= height else (height, width)
+    new_long = int(CROP_RESIZE * long / short)
+    size = (CROP_RESIZE, new_long) if width <= height else (new_long, CROP_RESIZE)
+    pixels = np.array(image.resize(size, Image.BILINEAR))
+    top = int(round((pixels.shape[0] - INPUT_SIZE) / 2.0))
+    left = int(round((pixels.shape[1] - INPUT_SIZE) / 2.0))
+    return np.ascontiguousarray(pixels[top:top + INPUT_SIZE, left:left + INPUT_SIZE])
+
+
+def to_tensor(pixels, variant):
+    """
+    (N, 3, 224, 224) float tensor for a stack of (N, 224, 224, 3) uint8 pixels: scaling to 0-1 and
+    normalization run as in-place passes over a single float buffer, for the whole batch at once.
+    """
+    tensor = torch.from_numpy(pixels).permute(0, 3, 1, 2).contiguous().float().div_(255)
+    if variant in _NORMALIZATION:
+        mean, std = _NORMALIZATION[variant]
+        tensor.sub_(mean).div_(std)
+    return tensor
+
+
+class PreparedImage:
+    """
+    A decoded upload with its resized pixels and model input tensors, each computed once on first
+    use. Every stage that sees the same upload shares them - e.g. the normal and half tensors both
+    come from one 224x224 uint8 resize. `timer(name)`, if given, is entered around the work
+    (e.g. to record preprocessing time).
+    """
+
+    def __init__(self, image, device=None, timer=None):
+        self.image = image
+        self.device = device
+        self.timer = timer or (lambda name: nullcontext())
+        self._pixels = {}
+        self._tensors = {}
+
+    def pixels(self, geometry):
+        if geometry not in self._pixels:
+            self._pixels[geometry] = resize_pixels(self.image, geometry)
+        return self._pixels[geometry]
+
+    def tensor(self, variant):
+        """(1, 3, 224, 224) input tensor for `variant`, on `device` if one was given"""
+        if variant not in self._tensors:
+            with self.timer("preprocess"):
+                tensor = to_tensor(self.pixels(VARIANTS[variant][0])[None], variant)
+                self._tensors[variant] = tensor.to(self.device) if self.device is not None else tensor
+        return self._tensors[variant]
+
+
+def batch_tensor(prepared, variant):
+    """(N, 3, 224, 224) input tensor for a list of PreparedImage"""
+    geometry = VARIANTS[variant][0]
+    return to_tensor(np.stack([item.pixels(geometry) for item in prepared]), variant)
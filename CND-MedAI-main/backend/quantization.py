@@ -0,0 +1,92 @@
+import os
+
+import torch
+import torch.nn as nn
+
+from architectures import build_model, example_input
+
+# INT8 quantization used for each model by default:
+#   dynamic - weights stored as int8, activations quantized on the fly. Suits models whose
+#             cost is in Linear/LSTM layers (SimpleCNN.fc1, the EEG LSTM, ConvNeXt's MLPs).
+#   static  - post-training quantization of the conv backbones (FX graph mode), with
+#             activation ranges calibrated on sample images.
+QUANTIZATION_MODES = {
+    "stage1": "dynamic",
+    "stage2": "static",
+    "stage3": "static",
+    "epilepsy": "dynamic",
+    "cancer_breast": "static",
+    "cancer_colon": "static",
+    "cancer_lung": "static",
+    "neuro_alzheimers": "static",
+    "neuro_ms": "dynamic",
+}
+QUANTIZED_ENGINE = "x86"
+
+
+def quantized_path(quantized_dir, name):
+    return os.path.join(quantized_dir, name + ".int8.pth")
+
+
+def _set_engine():
+    if QUANTIZED_ENGINE in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = QUANTIZED_ENGINE
+
+
+def quantize_dynamic(model):
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.LSTM}, dtype=torch.qint8)
+
+
+def prepare_static(model, name):
+    """Insert observers into `model` - run calibration batches through the result, then convert_static()"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    _set_engine()
+    return prepare_fx(model, get_default_qconfig_mapping(QUANTIZED_ENGINE), (example_input(name, 1),))
+
+
+def convert_static(prepared):
+    from torch.ao.quantization.quantize_fx import convert_fx
+    return convert_fx(prepared)
+
+
+def save_quantized(model, name, mode, quantized_dir):
+    os.makedirs(quantized_dir, exist_ok=True)
+    path = quantized_path(quantized_dir, name)
+    torch.save({"mode": mode, "engine": QUANTIZED_ENGINE, "state_dict": model.state_dict()}, path)
+    return path
+
+
+def load_quantized(name, quantized_dir, device):
+    """
+    INT8 model written by quantize_models.py, or None when it isn't available so the caller can
+    fall back to fp32. Quantized kernels are CPU-only. The architecture is rebuilt and put through
+    the same quantization transform, then the saved int8 weights and scales are loaded into it.
+    """
+    if device.type != "cpu":
+        print(f"Quantized {name} model needs the CPU, using fp32")
+        return None
+    path = quantized_path(quantized_dir, name)
+    if not os.path.exists(path):
+        print(f"No quantized model for {name} at {path}, using fp32")
+        return None
+    try:
+        if hasattr(torch.serialization, "safe_globals"):
+            # Packed dynamic-quantized weights are ScriptObjects, which weights_only loading rejects by default
+            with torch.serialization.safe_globals([torch.ScriptObject]):
+                checkpoint = torch.load(path, map_location="cpu")
+        else:
+            checkpoint = torch.load(path, map_location="cpu")
+        _set_engine()
+        model = build_model(name).eval()
+        if checkpoint["mode"] == "dynamic":
+            model = quantize_dynamic(model)
+        else:
+            model = convert_static(prepare_static(model, name))
+        model.load_state_dict(checkpoint["state_dict"])
+        model.eval()
+        print(f"Serving {name} with {checkpoint['mode']} INT8 quantization from {path}")
+        return model
+    except Exception as e:
+        print(f"Failed to load quantized model for {name}: {e}, using fp32")
+        return None
@@ -0,0 +1,197 @@
+"""
+Quantize the pipeline models to INT8 and compare them against fp32, so QUANTIZED_MODELS can be
+enabled only for the models where accuracy holds up.
+
+    python quantize_models.py --images ./sample_scans           # every model
+    python quantize_models.py --models stage1 epilepsy           # no images needed for the EEG model
+
+Models listed as "static" in quantization.QUANTIZATION_MODES are calibrated on the first
+--calibration-images images of --images; the rest are used for the comparison (when there are
+too few images, the calibration images are reused and the report says so). The EEG model is
+compared on the rows of --csv, including accuracy against its `y` column.
+
+For every model the report gives the share of inputs where the INT8 prediction matches fp32,
+the largest output difference, single-input and batched latency, and the size of the weights.
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+
+import eeg
+import quantization
+from model_loading import MODEL_NAMES, load_model, subtype_to_model
+from preprocessing import PreparedImage, batch_tensor, decode_image, final_variant, IMAGE_EXTENSIONS, NORMAL, SUBTYPE
+
+
+def image_variant(name):
+    """Input variant app.py builds for the named image model"""
+    if name == "stage3":
+        return SUBTYPE
+    if name in subtype_to_model:
+        return final_variant(name)
+    return NORMAL
+
+
+def load_images(directory):
+    images = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        try:
+            with open(os.path.join(directory, filename), "rb") as f:
+                images.append(PreparedImage(decode_image(f)))
+        except Exception as e:
+            print(f"Skipping {filename}: {e}")
+    return images
+
+
+def load_eeg_rows(csv_path, max_rows):
+    with open(csv_path, "rb") as f:
+        columns = eeg.feature_columns(f)
+        features = np.concatenate(list(eeg.iter_feature_chunks(f, columns, max_rows)))[:max_rows]
+    labels = None
+    if "y" in pd.read_csv(csv_path, nrows=0).columns:
+        labels = pd.read_csv(csv_path, usecols=["y"], nrows=max_rows)["y"].to_numpy()
+    return torch.from_numpy(features).unsqueeze(2), labels
+
+
+def predictions(name, output):
+    """Class decisions the routes make from a model output, one per input"""
+    if name == "epilepsy":
+        return (output.reshape(-1) >= eeg.SEIZURE_THRESHOLD).long()
+    if name in ("stage1", "stage2"):
+        return (output.reshape(-1) > 0.5).long()
+    return output.argmax(dim=1)
+
+
+def run_batches(model, inputs, batch_size=16):
+    with torch.no_grad():
+        return torch.cat([model(inputs[i:i + batch_size]).reshape(len(inputs[i:i + batch_size]), -1)
+                          for i in range(0, len(inputs), batch_size)])
+
+
+def latency_ms(model, example, repeats):
+    """Median wall time of a forward pass over `example`"""
+    times = []
+    with torch.no_grad():
+        model(example)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(example)
+            times.append(time.perf_counter() - start)
+    return round(float(np.median(times)) * 1000, 3)
+
+
+def size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return round(buffer.tell() / (1024 * 1024), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=MODEL_NAMES, choices=MODEL_NAMES)
+    parser.add_argument("--images", help="directory of sample .jpg/.png scans for calibration and comparison")
+    parser.add_argument("--csv", default="./balanced_test_data.csv", help="EEG rows for the epilepsy model (default: %(default)s)")
+    parser.add_argument("--csv-rows", type=int, default=2000)
+    parser.add_argument("--calibration-images", type=int, default=32)
+    parser.add_argument("--mode", choices=["auto", "dynamic", "static"], default="auto",
+                        help="override quantization.QUANTIZATION_MODES (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=20, help="timed runs per latency measurement")
+    parser.add_argument("--out", default=os.environ.get("QUANTIZED_DIR", "./AI-Models/quantized"), help="output directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    images = load_images(args.images) if args.images else []
+    report = {}
+    for name in args.models:
+        mode = quantization.QUANTIZATION_MODES[name] if args.mode == "auto" else args.mode
+        if name == "epilepsy":
+            if mode == "static":
+                print("[epilepsy] static quantization isn't supported for the LSTM, using dynamic")
+                mode = "dynamic"
+            if not os.path.exists(args.csv):
+                print(f"[epilepsy] {args.csv} not found, skipping")
+                report[name] = {"error": f"{args.csv} not found"}
+                continue
+            evaluation, labels = load_eeg_rows(args.csv, args.csv_rows)
+            calibration, reused = None, False
+        else:
+            if not images:
+                print(f"[{name}] no sample images (--images), skipping")
+                report[name] = {"error": "no sample images"}
+                continue
+            tensors = batch_tensor(images, image_variant(name))
+            calibration = tensors[:args.calibration_images]
+            reused = len(tensors) <= args.calibration_images
+            evaluation = tensors if reused else tensors[args.calibration_images:]
+            labels = None
+
+        eager = load_model(name, device)
+        if eager is None:
+            print(f"[{name}] could not be loaded, skipping")
+            report[name] = {"error": "model could not be loaded"}
+            continue
+
+        start = time.perf_counter()
+        try:
+            if mode == "dynamic":
+                quantized = quantization.quantize_dynamic(copy.deepcopy(eager))
+            else:
+                prepared = quantization.prepare_static(copy.deepcopy(eager), name)
+                run_batches(prepared, calibration)
+                quantized = quantization.convert_static(prepared)
+            path = quantization.save_quantized(quantized, name, mode, args.out)
+        except Exception as e:
+            print(f"[{name}] {mode} quantization failed: {e}")
+            report[name] = {"mode": mode, "error": str(e)}
+            continue
+
+        expected = run_batches(eager, evaluation)
+        actual = run_batches(quantized, evaluation)
+        agree = (predictions(name, expected) == predictions(name, actual)).float().mean().item()
+        example = evaluation[:1]
+        batch = evaluation[:8]
+        result = {
+            "mode": mode,
+            "path": path,
+            "quantize_seconds": round(time.perf_counter() - start, 2),
+            "samples": len(evaluation),
+            "evaluated_on_calibration_images": reused,
+            "prediction_agreement": round(agree, 4),
+            "max_abs_diff": (expected - actual).abs().max().item(),
+            "fp32_latency_ms": latency_ms(eager, example, args.repeats),
+            "int8_latency_ms": latency_ms(quantized, example, args.repeats),
+            f"fp32_batch{len(batch)}_ms": latency_ms(eager, batch, args.repeats),
+            f"int8_batch{len(batch)}_ms": latency_ms(quantized, batch, args.repeats),
+            "fp32_mb": size_mb(eager),
+            "int8_mb": size_mb(quantized),
+        }
+        result["speedup"] = round(result["fp32_latency_ms"] / result["int8_latency_ms"], 2)
+        if labels is not None:
+            truth = torch.from_numpy(labels).long()
+            result["fp32_accuracy"] = round((predictions(name, expected) == truth).float().mean().item(), 4)
+            result["int8_accuracy"] = round((predictions(name, actual) == truth).float().mean().item(), 4)
+        report[name] = result
+        print(f"[{name}] {mode}: agreement {result['prediction_agreement']:.2%}, "
+              f"{result['fp32_latency_ms']} -> {result['int8_latency_ms']} ms, "
+              f"{result['fp32_mb']} -> {result['int8_mb']} MB")
+
+    os.makedirs(args.out, exist_ok=True)
+    report_path = os.path.join(args.out, "quantization_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {report_path}")
+    print("Enable the models that hold up with e.g. QUANTIZED_MODELS=" +
+          ",".join(name for name, r in report.items() if r.get("prediction_agreement", 0) >= 0.99))
+
+
+if __name__ == "__main__":
+    main()
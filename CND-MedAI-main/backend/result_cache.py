@@ -0,0 +1,217 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def model_fingerprint(model_dir, patterns=("*.pth", "*.pt", "*.onnx", "*.safetensors"), config=None):
+    """
+    Hash of the name, size and modification time of every model file under model_dir, plus
+    `config` (JSON-serializable settings that change how the results are computed)
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    if config is not None:
+        digest.update(json.dumps(config, sort_keys=True).encode())
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.join(model_dir, "**", pattern), recursive=True))
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.relpath(path, model_dir)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def content_digest(*parts):
+    """Hash of the given bytes-like parts (e.g. decoded image pixels)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of JSON-serializable inference results keyed by content hash.
+    Entries expire after `ttl` seconds and the in-memory tier is bounded to `max_bytes`
+    (least recently used entries are evicted first). With `disk_path` set, results are also
+    written to a SQLite file so they survive restarts. Every entry is tied to the model
+    fingerprint - when a .pth file (or the serving configuration) changes the whole cache is dropped.
+    """
+
+    def __init__(self, fingerprint_fn, max_bytes=64 * 1024 * 1024, ttl=3600, disk_path=None,
+                 check_interval=5.0, on_invalidate=None):
+        self.fingerprint_fn = fingerprint_fn
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.check_interval = check_interval
+        self.on_invalidate = on_invalidate
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.fingerprint = fingerprint_fn()
+        self._checked_at = time.monotonic()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # ---- disk tier ----
+    # The SQLite file is read and written outside self._lock, each thread on its own connection
+    # (WAL mode lets readers and a writer work at once), so disk I/O doesn't stall memory hits.
+    def _connection(self):
+        # One connection per thread and process (connections must not cross a fork)
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.disk_path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, expires_at REAL, value TEXT)"
+            )
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _disk_get(self, key, fingerprint):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM results WHERE key = ? AND fingerprint = ?",
+            (key, fingerprint),
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def _disk_set(self, key, payload, fingerprint):
+        db = self._connection()
+        db.execute(
+            "INSERT OR REPLACE INTO results (key, fingerprint, expires_at, value) VALUES (?, ?, ?, ?)",
+            (key, fingerprint, time.time() + self.ttl, payload),
+        )
+        db.commit()
+
+    def _disk_prune(self, fingerprint):
+        db = self._connection()
+        db.execute("DELETE FROM results WHERE fingerprint != ? OR expires_at < ?", (fingerprint, time.time()))
+        db.commit()
+
+    # ---- invalidation ----
+    def _check_fingerprint(self):
+        """
+        Drop every entry when the fingerprint has changed. Called without self._lock: only the swap
+        of the fingerprint and the in-memory entries happens under it. Computing the fingerprint,
+        pruning the disk tier and on_invalidate (which may reload models) run after it is released.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+        fingerprint = self.fingerprint_fn()
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return
+            print(f"Model files changed ({self.fingerprint} -> {fingerprint}), clearing result cache")
+            self.fingerprint = fingerprint
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+        if self.disk_path:
+            self._disk_prune(fingerprint)
+        if self.on_invalidate is not None:
+            self.on_invalidate()
+
+    # ---- public API ----
+    def get(self, key):
+        self._check_fingerprint()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._drop(key)
+            fingerprint = self.fingerprint
+            if not self.disk_path:
+                self.misses += 1
+                return None
+        payload = self._disk_get(key, fingerprint)
+        value = json.loads(payload) if payload is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            if fingerprint == self.fingerprint:
+                self._store(key, value, len(payload))
+            return value
+
+    def set(self, key, value, fingerprint=None):
+        """
+        Cache `value` under `key`. Pass the fingerprint read before computing it to drop results
+        that were computed while the models changed.
+        """
+        payload = json.dumps(value)
+        self._check_fingerprint()
+        with self._lock:
+            if fingerprint is not None and fingerprint != self.fingerprint:
+                return
+            fingerprint = self.fingerprint
+            self._store(key, value, len(payload))
+        if self.disk_path:
+            self._disk_set(key, payload, fingerprint)
+
+    def _store(self, key, value, size):
+        # Caller must hold self._lock
+        if size > self.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_path:
+            db = self._connection()
+            db.execute("DELETE FROM results")
+            db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "disk_path": self.disk_path,
+                "model_fingerprint": self.fingerprint,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
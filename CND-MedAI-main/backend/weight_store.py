@@ -0,0 +1,147 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+import torch
+
+# Layout of a weight store directory (written by convert_weights.py):
+#   weights.safetensors - every distinct tensor of every checkpoint, stored once under its content hash
+#   manifest.json       - for each checkpoint, its parameter names -> tensor keys, the wrapper key
+#                         ("state_dict" / "model") it had, and the size/mtime of the .pth it came from
+STORE_FILE = "weights.safetensors"
+MANIFEST_FILE = "manifest.json"
+
+_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def checkpoint_name(path):
+    """Name of a checkpoint in the store - its file name without .pth"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def tensor_key(tensor):
+    """Content hash of a tensor - equal tensors in different checkpoints are stored once"""
+    data = tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+    digest = hashlib.sha256(data.tobytes())
+    digest.update(f"{tensor.dtype}{tuple(tensor.shape)}".encode())
+    return digest.hexdigest()
+
+
+def unwrap_checkpoint(checkpoint):
+    """(wrapper key or None, state dict) - the same 'state_dict' / 'model' unwrapping app.py does"""
+    if isinstance(checkpoint, dict):
+        for wrapper in ("state_dict", "model"):
+            if isinstance(checkpoint.get(wrapper), dict):
+                return wrapper, checkpoint[wrapper]
+    return None, checkpoint
+
+
+class WeightStore:
+    """
+    Reads checkpoints from a weight store. The store file is memory-mapped and every tensor is a
+    view of the mapping, so loading reads no data up front (pages are faulted in as the weights
+    are used) and worker processes share one copy of the weights through the OS page cache.
+    No pickle is executed. The mapping is copy-on-write, so nothing ever writes to the file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_FILE)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.manifest = None
+        if os.path.exists(manifest_path) and os.path.exists(self.path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        self._buffer = None
+        self._header = None
+        self._data_start = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return self.manifest is not None and name in self.manifest["models"]
+
+    def is_current(self, name, source_path):
+        """Whether `name` is in the store and was converted from the .pth as it is now"""
+        if name not in self:
+            return False
+        if not os.path.exists(source_path):
+            return True
+        entry = self.manifest["models"][name]
+        return all(entry.get(field) == value for field, value in source_signature(source_path).items())
+
+    def _open(self):
+        with self._lock:
+            if self._buffer is None:
+                with open(self.path, "rb") as f:
+                    self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                header_size, = struct.unpack("<Q", self._buffer[:8])
+                self._header = json.loads(self._buffer[8:8 + header_size])
+                self._header.pop("__metadata__", None)
+                self._data_start = 8 + header_size
+
+    def tensor(self, key):
+        self._open()
+        info = self._header[key]
+        dtype = _DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if start == end:
+            return torch.empty(info["shape"], dtype=dtype)
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        flat = torch.frombuffer(self._buffer, dtype=dtype, count=count, offset=self._data_start + start)
+        return flat.view(info["shape"])
+
+    def load(self, name, device=None):
+        """The checkpoint as torch.load would return it (re-wrapped in its 'state_dict' / 'model' key)"""
+        entry = self.manifest["models"][name]
+        state_dict = {param: self.tensor(key) for param, key in entry["tensors"].items()}
+        if device is not None and device.type != "cpu":
+            state_dict = {param: tensor.to(device) for param, tensor in state_dict.items()}
+        return {entry["wrapper"]: state_dict} if entry.get("wrapper") else state_dict
+
+    def tensors(self):
+        """Every tensor in the store by key"""
+        if self.manifest is None:
+            return {}
+        self._open()
+        return {key: self.tensor(key) for key in self._header}
+
+
+def write_store(directory, checkpoints, metadata=None):
+    """
+    Write a store for `checkpoints` ({name: (wrapper, state dict, source signature)}), keeping every
+    distinct tensor once. Returns the manifest. Needs the safetensors package.
+    """
+    from safetensors.torch import save_file
+
+    os.makedirs(directory, exist_ok=True)
+    unique = {}
+    models = {}
+    for name, (wrapper, state_dict, signature) in checkpoints.items():
+        keys = {}
+        for param, tensor in state_dict.items():
+            key = tensor_key(tensor)
+            unique.setdefault(key, tensor.detach().cpu().contiguous())
+            keys[param] = key
+        models[name] = {"wrapper": wrapper, "tensors": keys, **signature}
+    manifest = {"models": models, **(metadata or {})}
+
+    store_tmp = os.path.join(directory, STORE_FILE + ".tmp")
+    manifest_tmp = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    save_file(unique, store_tmp)
+    with open(manifest_tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(store_tmp, os.path.join(directory, STORE_FILE))
+    os.replace(manifest_tmp, os.path.join(directory, MANIFEST_FILE))
+    return manifest
@@ -0,0 +1,9 @@
+"""
+Production entry point. Serve with gunicorn so the models are loaded once in the
+master process and shared copy-on-write by the forked workers:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app
+
+__all__ = ["app"]
@@ -296,20 +296,20 @@ const UploadImage = () => {
         return;
       }
 
-      // Otherwise, run image pipeline: /predict → /classify → /subtype
-      // Step 1: Modality check
-      const predictRes = await fetch(`${flaskBase}/predict`, {
+      // Otherwise, run the image pipeline (modality → classification → subtype → diagnosis)
+      // in a single request so the image is uploaded and decoded only once
+      const pipelineRes = await fetch(`${flaskBase}/pipeline`, {
         method: 'POST',
         body: formData,
       });
-      const predictData = await predictRes.json();
-      console.log('Predict response:', predictData);
-      if (!predictRes.ok) {
-        throw new Error(predictData.error || 'Modality check failed');
+      const pipelineData = await pipelineRes.json();
+      console.log('Pipeline response:', pipelineData);
+      if (!pipelineRes.ok) {
+        throw new Error(pipelineData.error || 'Image analysis failed');
       }
       
       // Check if not our modality
-      if (predictData.isNotOurModality || predictData.prediction !== 'Our Modality') {
+      if (pipelineData.isNotOurModality || pipelineData.prediction !== 'Our Modality') {
         console.log('Not our modality detected, showing alert');
         setShowNotModalityAlert(true);
         toast({ 
@@ -321,47 +321,13 @@ const UploadImage = () => {
         return;
       }
 
-      // Step 2: Classify (Cancer vs Neurological)
-      const classifyRes = await fetch(`${flaskBase}/classify`, {
-        method: 'POST',
-        body: formData,
-      });
-      const classifyData = await classifyRes.json();
-      if (!classifyRes.ok) {
-        throw new Error(classifyData.error || 'Classification failed');
-      }
-
-      // Step 3: Subtype classification
-      const subtypeRes = await fetch(`${flaskBase}/subtype`, {
-        method: 'POST',
-        body: formData,
-      });
-      const subtypeData = await subtypeRes.json();
-      if (!subtypeRes.ok) {
-        throw new Error(subtypeData.error || 'Subtype classification failed');
-      }
-
-  // Step 4: Final diagnosis using disease-specific model
-      const diagnosisFormData = new FormData();
-      diagnosisFormData.append('file', uploadedFile);
-      diagnosisFormData.append('subtype', subtypeData.subtype_prediction);
-      
-      const diagnosisRes = await fetch(`${flaskBase}/diagnose`, {
-        method: 'POST',
-        body: diagnosisFormData,
-      });
-      const diagnosisData = await diagnosisRes.json();
-      if (!diagnosisRes.ok) {
-        throw new Error(diagnosisData.error || 'Final diagnosis failed');
-      }
-
       // All 4 pipelines succeeded
       const resultObj = {
         stage: 'Complete Pipeline (4 stages)',
-        modality: predictData.prediction,
-        classification: classifyData.classification,
-        subtype: subtypeData.subtype_prediction,
-        diagnosis: diagnosisData.diagnosis,
+        modality: pipelineData.prediction,
+        classification: pipelineData.classification,
+        subtype: pipelineData.subtype_prediction,
+        diagnosis: pipelineData.diagnosis,
       };
       setPipelineResult(resultObj);
       setShowResultDialog(true);
@@ -385,7 +351,7 @@ const UploadImage = () => {
           fileData,
           fileType: uploadedFile.type,
           fileSize: uploadedFile.size,
-          imageType: subtypeData.subtype_prediction,
+          imageType: pipelineData.subtype_prediction,
           patientInfo: {
             name: patientInfo.name,
             age: parseInt(patientInfo.age),
@@ -399,10 +365,10 @@ const UploadImage = () => {
             doctorId: patientInfo.doctorId || undefined
           },
           results: {
-            diagnosis: diagnosisData.diagnosis,
-            findings: diagnosisData.findings || [],
-            recommendations: diagnosisData.recommendations || [],
-            processingTime: diagnosisData.processing_time || 0
+            diagnosis: pipelineData.diagnosis,
+            findings: pipelineData.findings || [],
+            recommendations: pipelineData.recommendations || [],
+            processingTime: (pipelineData.timings_ms && pipelineData.timings_ms.total) || 0
           }
         };
 